@@ -11,18 +11,33 @@ from datetime import datetime
 import json
 import os
 import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
 from io import BytesIO
 import hashlib
+import heapq
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Optional imports for file handling
 try:
     import PyPDF2
+    import pdf_pages
     PDF_SUPPORT = True
 except ImportError:
     PDF_SUPPORT = False
 
 try:
     from docx import Document
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
     DOCX_SUPPORT = True
 except ImportError:
     DOCX_SUPPORT = False
@@ -31,10 +46,18 @@ except ImportError:
 try:
     import msal
     import requests
+    import requests.adapters
     EXCEL_ONLINE_SUPPORT = True
 except ImportError:
     EXCEL_ONLINE_SUPPORT = False
 
+# Local workbook storage (an .xlsx file with the same sheets as Excel Online)
+try:
+    import openpyxl
+    LOCAL_WORKBOOK_SUPPORT = True
+except ImportError:
+    LOCAL_WORKBOOK_SUPPORT = False
+
 # Page configuration
 st.set_page_config(
     page_title="Assessment Report Analyzer | UTA",
@@ -586,6 +609,116 @@ REPORT_TYPES = [
     "Next Cycle Plan"
 ]
 
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+
+# Local cache location and size limits
+CACHE_DIR = os.environ.get("ANALYZER_CACHE_DIR", ".cache")
+EXTRACTION_CACHE_MAX_BYTES = int(float(os.environ.get("EXTRACTION_CACHE_MAX_MB", "50")) * 1024 * 1024)
+ANALYSIS_CACHE_MAX_BYTES = int(float(os.environ.get("ANALYSIS_CACHE_MAX_MB", "50")) * 1024 * 1024)
+MESSAGE_BATCHES_PATH = os.path.join(CACHE_DIR, "message_batches.json")
+BATCH_IMPORT_DB_PATH = os.path.join(CACHE_DIR, "batch_import.sqlite")
+# Batch import statuses whose stored metadata can be reused instead of
+# re-extracting ("dismissed" files are extracted again when uploaded again)
+BATCH_COMPLETED_STATUSES = ("extracted", "saved")
+
+# SQLite mirror of the metadata sheets for the Explore page, with an index on
+# each of these columns wherever a sheet has it
+ANALYTICS_DB_PATH = os.path.join(CACHE_DIR, "analytics.sqlite")
+ANALYTICS_INDEXED_COLUMNS = ["unit_id", "academic_year", "college_division", "achievement_level"]
+
+# Metadata storage: "excel" reads and writes Excel Online directly; "local"
+# keeps the sheets in a workbook on disk and syncs them to Excel Online every
+# LOCAL_SYNC_INTERVAL seconds (0 syncs only when an admin asks)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "excel")
+LOCAL_WORKBOOK_PATH = os.environ.get("LOCAL_WORKBOOK_PATH", os.path.join(CACHE_DIR, "assessment_data.xlsx"))
+LOCAL_SYNC_INTERVAL = float(os.environ.get("LOCAL_SYNC_INTERVAL", "0"))
+
+# Worksheet read cache: seconds before the workbook version is rechecked, and
+# an optional on-disk copy (0 keeps worksheet data in memory only)
+WORKSHEET_CACHE_TTL = float(os.environ.get("WORKSHEET_CACHE_TTL", "30"))
+WORKSHEET_CACHE_MAX_BYTES = int(float(os.environ.get("WORKSHEET_CACHE_MAX_MB", "0")) * 1024 * 1024)
+
+# Batch extraction concurrency (overridable via environment)
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "4"))
+BATCH_REQUESTS_PER_MINUTE = int(os.environ.get("BATCH_REQUESTS_PER_MINUTE", "40"))
+
+# PDF text extraction: pages beyond an optional cap are skipped (0 reads every
+# page), and documents with at least PDF_PARALLEL_MIN_PAGES pages are split
+# across worker processes
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", "0"))
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "24"))
+PDF_MAX_PROCESSES = int(os.environ.get("PDF_MAX_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+# Extracted-text cache: bump the version whenever an extractor's output changes.
+# Entries are kept in memory, and on disk as well when TEXT_CACHE_MAX_MB > 0
+TEXT_EXTRACTOR_VERSION = "2"
+TEXT_CACHE_MAX_ENTRIES = int(os.environ.get("TEXT_CACHE_MAX_ENTRIES", "64"))
+TEXT_CACHE_MAX_BYTES = int(float(os.environ.get("TEXT_CACHE_MAX_MB", "0")) * 1024 * 1024)
+
+# Background analysis jobs: worker threads shared by all sessions, how often
+# the page polls a running job, and how long an uncollected result is kept
+ANALYSIS_JOB_WORKERS = int(os.environ.get("ANALYSIS_JOB_WORKERS", "4"))
+ANALYSIS_JOB_POLL_SECONDS = 1.0
+ANALYSIS_JOB_RETENTION = 3600
+
+# Unit registry files, shared by all sessions once loaded
+ACADEMIC_REGISTRY_PATH = "unit_registry_academic.csv"
+ADMIN_REGISTRY_PATH = "unit_registry_admin.csv"
+REGISTRY_COLUMNS = ["unit_id", "canonical_name", "college_dept", "unit_type", "previous_names", "active"]
+
+# Scored unit-name suggestions: candidates below the minimum are hidden
+UNIT_SUGGESTION_COUNT = 5
+UNIT_SUGGESTION_MIN_SCORE = 0.3
+
+# Excel Online worksheet columns for each report type
+RESULTS_SHEET_HEADERS = [
+    "unit_id", "unit_type", "unit_name", "college_division", "degree_level",
+    "modality", "academic_year", "report_type", "outcome_id", "outcome_text",
+    "outcome_label", "related_competency_or_function", "strategic_plan_theme",
+    "core_objective", "assessment_method", "assessment_method_normalized",
+    "sample_size", "benchmark", "result_value", "achievement_level",
+    "gap_from_benchmark", "proposed_improvement", "responsible_party",
+    "improvement_timeline", "upload_timestamp", "last_updated"
+]
+
+IMPROVEMENT_SHEET_HEADERS = [
+    "unit_id", "unit_type", "unit_name", "college_division",
+    "academic_year", "report_type", "outcome_id", "improvement_action_taken",
+    "connection_to_previous", "previous_proposal_text",
+    "upload_timestamp", "last_updated"
+]
+
+PLAN_SHEET_HEADERS = [
+    "unit_id", "unit_type", "unit_name", "college_division", "degree_level",
+    "academic_year", "report_type", "outcome_id", "outcome_text",
+    "outcome_label", "related_competency_or_function", "strategic_plan_theme",
+    "core_objective", "planned_method", "planned_benchmark",
+    "action_steps", "responsible_party", "upload_timestamp", "last_updated"
+]
+
+# Microsoft Graph endpoint (overridable to point at a local mock server)
+GRAPH_BASE_URL = os.environ.get("GRAPH_BASE_URL", "https://graph.microsoft.com/v1.0")
+
+# Refresh cached Graph access tokens this many seconds before they expire
+GRAPH_TOKEN_REFRESH_MARGIN = 300
+
+# Bulk sheet writes: untouched rows that may be rewritten to join two runs of
+# changed rows (0 joins only adjacent rows; see coalesce_row_writes), and rows
+# per request
+BULK_WRITE_MAX_GAP = int(os.environ.get("BULK_WRITE_MAX_GAP", "0"))
+BULK_WRITE_MAX_ROWS = 250
+
+# Microsoft Graph JSON batching limit
+GRAPH_BATCH_MAX_REQUESTS = 20
+
+# Graph HTTP behaviour: (connect, read) timeouts, throttling retries, pool size
+GRAPH_TIMEOUT = (5, 60)
+GRAPH_MAX_RETRIES = 4
+GRAPH_RETRY_STATUSES = (429, 503)
+GRAPH_BACKOFF_BASE = 0.5
+GRAPH_MAX_BACKOFF = 60
+GRAPH_POOL_SIZE = 16
+
 # ============================================================================
 # DEFAULT PROMPTS - Editable by Admin
 # ============================================================================
@@ -851,7 +984,6 @@ def init_session_state():
         "results": None,
         "extracted_metadata": None,
         "filename": None,
-        "unit_registry": None,
         "gsheet_connected": False,
         "batch_mode": False,
         "batch_files": [],
@@ -936,94 +1068,355 @@ def check_password():
 # FILE PROCESSING
 # ============================================================================
 
-def extract_text_from_pdf(file) -> str:
-    """Extract text from PDF file."""
+@st.cache_resource
+def _pdf_process_slot() -> threading.Semaphore:
+    """Allow one page-parallel PDF extraction at a time per server."""
+    return threading.Semaphore(1)
+
+def _extract_pdf_pages_parallel(pdf_bytes: bytes, page_count: int) -> list:
+    """Split pages into contiguous chunks across worker processes, keeping page order.
+    
+    Workers run pdf_pages.py as fresh programs rather than forks of this
+    multi-threaded server. Returns None if another document is using them.
+    """
+    slot = _pdf_process_slot()
+    if not slot.acquire(blocking=False):
+        return None
+    
+    workers = min(PDF_MAX_PROCESSES, page_count)
+    chunk_size = -(-page_count // workers)
+    processes = []
+    pdf_path = None
+    try:
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as pdf_file:
+            pdf_path = pdf_file.name
+            pdf_file.write(pdf_bytes)
+        for start in range(0, page_count, chunk_size):
+            processes.append(subprocess.Popen(
+                [sys.executable, pdf_pages.__file__, pdf_path, str(start), str(min(start + chunk_size, page_count))],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            ))
+        
+        pages = []
+        for process in processes:
+            output, _ = process.communicate()
+            if process.returncode != 0:
+                raise RuntimeError(f"PDF worker exited with status {process.returncode}")
+            pages.extend((page_text, seconds) for page_text, seconds in json.loads(output))
+        return pages
+    finally:
+        # Release the slot even if cleanup fails, or page-parallel extraction stays off
+        try:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            if pdf_path:
+                os.remove(pdf_path)
+        finally:
+            slot.release()
+
+def extract_text_from_pdf(file, max_pages: int = None, stats: dict = None) -> str:
+    """Extract text from PDF file.
+    
+    Reads at most max_pages pages (PDF_MAX_PAGES by default; 0 reads every
+    page). Large documents are extracted page-parallel in worker processes,
+    falling back to serial extraction if that isn't possible. If stats is given, it receives page
+    counts, the mode used, and per-page timings.
+    """
     if not PDF_SUPPORT:
         st.error("PDF support not available. Please install PyPDF2.")
         return ""
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    if stats is None:
+        stats = {}
+    
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-        return text
+        start = time.perf_counter()
+        pdf_bytes = file.getvalue() if hasattr(file, "getvalue") else file.read()
+        pdf_reader = PyPDF2.PdfReader(BytesIO(pdf_bytes))
+        total_pages = len(pdf_reader.pages)
+        page_count = min(total_pages, max_pages) if max_pages else total_pages
+        
+        pages = None
+        mode = "serial"
+        if page_count >= PDF_PARALLEL_MIN_PAGES and PDF_MAX_PROCESSES > 1:
+            try:
+                pages = _extract_pdf_pages_parallel(pdf_bytes, page_count)
+            except Exception:
+                pages = None
+            if pages is not None:
+                mode = "parallel"
+        
+        if pages is None:
+            pages = []
+            for page in pdf_reader.pages[:page_count]:
+                page_start = time.perf_counter()
+                page_text = page.extract_text()
+                pages.append((page_text, time.perf_counter() - page_start))
+        
+        stats.update({
+            "pages_total": total_pages,
+            "pages_read": page_count,
+            "truncated": page_count < total_pages,
+            "mode": mode,
+            "page_seconds": [round(seconds, 4) for _, seconds in pages],
+            "seconds": time.perf_counter() - start
+        })
+        return "".join(page_text + "\n" for page_text, _ in pages if page_text)
     except Exception as e:
         st.error(f"Error reading PDF: {str(e)}")
         return ""
 
-def extract_text_from_docx(file) -> str:
-    """Extract text from Word document."""
+def _docx_table_lines(table, cell_text: dict) -> tuple:
+    """Render a table as compact "a | b" rows, once per merged cell.
+    
+    Returns (lines, legacy length), where the legacy length is what the old
+    every-cell-of-every-row output would have produced for this table.
+    """
+    lines = []
+    legacy_chars = 0
+    previous_row = []
+    
+    for row in table.rows:
+        cells = row.cells
+        values = []
+        seen = set()
+        for position, cell in enumerate(cells):
+            tc = cell._tc
+            if tc not in cell_text:
+                cell_text[tc] = cell.text
+            legacy_chars += len(cell_text[tc]) + 3
+            
+            if tc in seen:
+                continue  # horizontally merged: already emitted in this row
+            seen.add(tc)
+            if position < len(previous_row) and previous_row[position] is tc:
+                values.append("")  # vertically merged: emitted in the row above
+            else:
+                values.append(cell_text[tc].strip())
+        legacy_chars += 1
+        previous_row = [cell._tc for cell in cells]
+        
+        while values and not values[-1]:
+            values.pop()
+        if values:
+            lines.append(" | ".join(values))
+    
+    return lines, legacy_chars
+
+def extract_text_from_docx(file, stats: dict = None) -> str:
+    """Extract text from Word document.
+    
+    Paragraphs and tables come out in document order, with each merged cell
+    emitted once and table rows as compact "a | b" lines. If stats is given,
+    it receives the character and estimated token savings against the old
+    paragraphs-then-every-cell output.
+    """
     if not DOCX_SUPPORT:
         st.error("Word document support not available. Please install python-docx.")
         return ""
     try:
         doc = Document(file)
-        text = ""
-        for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    text += cell.text + " | "
-                text += "\n"
+        lines = []
+        legacy_chars = 0
+        cell_text = {}
+        
+        for element in doc.element.body.iterchildren():
+            if element.tag.endswith("}p"):
+                paragraph_text = Paragraph(element, doc).text
+                lines.append(paragraph_text)
+                legacy_chars += len(paragraph_text) + 1
+            elif element.tag.endswith("}tbl"):
+                table_lines, table_chars = _docx_table_lines(Table(element, doc), cell_text)
+                lines.extend(table_lines)
+                legacy_chars += table_chars
+        
+        text = "\n".join(lines) + "\n" if lines else ""
+        if stats is not None:
+            stats.update({
+                "chars": len(text),
+                "legacy_chars": legacy_chars,
+                "chars_saved": legacy_chars - len(text),
+                # Same 4-characters-per-token estimate as estimate_tokens
+                "tokens_saved": max(legacy_chars - len(text), 0) // 4
+            })
         return text
     except Exception as e:
         st.error(f"Error reading Word document: {str(e)}")
         return ""
 
-def process_uploaded_file(uploaded_file) -> str:
-    """Process uploaded file and extract text."""
-    if uploaded_file is None:
-        return ""
-    
+def _extract_uploaded_text(uploaded_file, stats: dict = None) -> str:
+    """Extract text with the parser matching the file type."""
     file_type = uploaded_file.type
     file_name = uploaded_file.name.lower()
     
     if file_type == "application/pdf" or file_name.endswith('.pdf'):
-        return extract_text_from_pdf(uploaded_file)
+        return extract_text_from_pdf(uploaded_file, stats=stats)
     elif file_type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"] or file_name.endswith('.docx'):
-        return extract_text_from_docx(uploaded_file)
+        return extract_text_from_docx(uploaded_file, stats=stats)
     elif file_type == "text/plain" or file_name.endswith('.txt'):
         return uploaded_file.read().decode("utf-8")
     else:
         st.error(f"Unsupported file type: {file_type}")
         return ""
 
+@st.cache_resource
+def _text_cache() -> dict:
+    """Process-wide LRU of extracted text, keyed by file content."""
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+def text_cache_info() -> dict:
+    """Summarize the in-memory extracted-text cache for the admin panel."""
+    cache = _text_cache()
+    with cache["lock"]:
+        return {
+            "entries": len(cache["entries"]),
+            "chars": sum(len(entry["text"]) for entry in cache["entries"].values())
+        }
+
+def clear_text_cache() -> int:
+    """Drop all cached extracted text, returning how many entries were removed."""
+    cache = _text_cache()
+    with cache["lock"]:
+        removed = len(cache["entries"])
+        cache["entries"].clear()
+    return removed + disk_cache_clear("text")
+
+def process_uploaded_file(uploaded_file, stats: dict = None, use_cache: bool = True) -> str:
+    """Process uploaded file and extract text, filling extractor stats if given.
+    
+    Text is cached by the SHA-256 of the file's bytes, so reruns and
+    re-uploads of the same file skip parsing.
+    """
+    if uploaded_file is None:
+        return ""
+    if not use_cache:
+        return _extract_uploaded_text(uploaded_file, stats)
+    
+    file_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    key = cache_key(TEXT_EXTRACTOR_VERSION, PDF_MAX_PAGES, os.path.splitext(uploaded_file.name.lower())[1], file_hash)
+    
+    cache = _text_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry is not None:
+            cache["entries"].move_to_end(key)
+    if entry is None and TEXT_CACHE_MAX_BYTES > 0:
+        entry = disk_cache_get("text", key)
+    cached = entry is not None
+    record_cache_event("text", hit=cached)
+    
+    if entry is None:
+        extraction_stats = {}
+        text = _extract_uploaded_text(uploaded_file, extraction_stats)
+        if not text:
+            if stats is not None:
+                stats.update(extraction_stats)
+            return text
+        entry = {"text": text, "stats": extraction_stats}
+        if TEXT_CACHE_MAX_BYTES > 0:
+            disk_cache_put("text", key, entry, TEXT_CACHE_MAX_BYTES)
+    
+    with cache["lock"]:
+        cache["entries"][key] = entry
+        cache["entries"].move_to_end(key)
+        while len(cache["entries"]) > TEXT_CACHE_MAX_ENTRIES:
+            cache["entries"].popitem(last=False)
+    
+    if stats is not None:
+        stats.update(entry["stats"])
+        stats["cached"] = cached
+    return entry["text"]
+
 # ============================================================================
 # UNIT REGISTRY MANAGEMENT
 # ============================================================================
 
-def load_unit_registry():
-    """Load unit registry from session or initialize from files."""
-    if st.session_state.get("unit_registry") is not None:
-        return st.session_state["unit_registry"]
-    
-    # Try to load from bundled CSV files
+@st.cache_resource
+def _unit_registry_store() -> dict:
+    """Process-wide unit registry shared by every session."""
+    return {"lock": threading.Lock(), "registry": None, "version": 0}
+
+def _registry_records(df: pd.DataFrame) -> list:
+    """Convert a registry CSV frame into records with blanks instead of NaN."""
+    return df.astype(object).where(df.notna(), "").to_dict('records')
+
+def _read_unit_registry_files() -> dict:
+    """Read the bundled registry CSV files."""
     registry = {"academic": [], "administrative": []}
     
-    # Check for local files first
-    academic_path = "unit_registry_academic.csv"
-    admin_path = "unit_registry_admin.csv"
-    
     try:
-        if os.path.exists(academic_path):
-            df = pd.read_csv(academic_path)
-            registry["academic"] = df.to_dict('records')
+        if os.path.exists(ACADEMIC_REGISTRY_PATH):
+            registry["academic"] = _registry_records(pd.read_csv(ACADEMIC_REGISTRY_PATH))
     except Exception as e:
         st.warning(f"Could not load academic registry: {e}")
     
     try:
-        if os.path.exists(admin_path):
-            df = pd.read_csv(admin_path)
-            registry["administrative"] = df.to_dict('records')
+        if os.path.exists(ADMIN_REGISTRY_PATH):
+            registry["administrative"] = _registry_records(pd.read_csv(ADMIN_REGISTRY_PATH))
     except Exception as e:
         st.warning(f"Could not load administrative registry: {e}")
     
-    st.session_state["unit_registry"] = registry
     return registry
 
+def load_unit_registry() -> dict:
+    """Return the shared unit registry, loading the CSV files on first use.
+    
+    The returned registry is a read-only snapshot; admin edits go through
+    publish_unit_registry with a modified copy.
+    """
+    store = _unit_registry_store()
+    if store["registry"] is None:
+        with store["lock"]:
+            if store["registry"] is None:
+                registry = _read_unit_registry_files()
+                _index_unit_registry(registry)
+                store["registry"] = registry
+                store["version"] = 1
+    return store["registry"]
+
+def unit_registry_version() -> int:
+    """Return the shared registry's version, bumped on every publish."""
+    return _unit_registry_store()["version"]
+
+def editable_unit_registry() -> dict:
+    """Return a copy of the shared registry that can be edited and published."""
+    registry = load_unit_registry()
+    return {"academic": list(registry["academic"]), "administrative": list(registry["administrative"])}
+
+def publish_unit_registry(registry: dict, persist: bool = False) -> int:
+    """Replace the shared registry for all sessions and return its new version.
+    
+    With persist=True the registry is also written back to the CSV files,
+    under the same lock, so the files always hold the latest published version.
+    """
+    registry = {"academic": registry.get("academic", []), "administrative": registry.get("administrative", [])}
+    _index_unit_registry(registry)
+    
+    store = _unit_registry_store()
+    with store["lock"]:
+        store["registry"] = registry
+        store["version"] += 1
+        version = store["version"]
+        
+        if persist:
+            try:
+                _write_registry_csv(registry["academic"], ACADEMIC_REGISTRY_PATH)
+                _write_registry_csv(registry["administrative"], ADMIN_REGISTRY_PATH)
+            except Exception as e:
+                st.warning(f"Registry updated for this server, but the CSV files could not be written: {e}")
+    return version
+
+def _write_registry_csv(units: list, path: str):
+    df = pd.DataFrame(units)
+    for column in REGISTRY_COLUMNS:
+        if column not in df:
+            df[column] = ""
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    df[REGISTRY_COLUMNS].to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
 def generate_unit_id(unit_name: str, college_dept: str, unit_type: str) -> str:
     """Generate a unique unit ID."""
     # Create a short hash for uniqueness
@@ -1033,100 +1426,362 @@ def generate_unit_id(unit_name: str, college_dept: str, unit_type: str) -> str:
     clean_dept = re.sub(r'[^A-Za-z0-9]', '', college_dept)[:10]
     return f"{clean_dept}-{short_hash}".upper()
 
+def _name_trigrams(name: str) -> dict:
+    """Count character trigrams per word, padded so word starts weigh more."""
+    counts = {}
+    for word in re.findall(r'[a-z0-9]+', name.lower()):
+        padded = f"  {word} "
+        for i in range(len(padded) - 2):
+            gram = padded[i:i + 3]
+            counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+def _build_trigram_index(names: list) -> dict:
+    """Build an inverted TF-IDF trigram index over (unit position, name) pairs."""
+    entry_grams = [_name_trigrams(name) for _, name in names]
+    
+    document_frequency = {}
+    for grams in entry_grams:
+        for gram in grams:
+            document_frequency[gram] = document_frequency.get(gram, 0) + 1
+    
+    total = len(names)
+    idf = {gram: math.log((1 + total) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+    
+    postings = {}
+    for entry, grams in enumerate(entry_grams):
+        weights = {gram: (1 + math.log(tf)) * idf[gram] for gram, tf in grams.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        for gram, weight in weights.items():
+            postings.setdefault(gram, []).append((entry, weight / norm))
+    
+    return {
+        "owners": [position for position, _ in names],
+        "names": [name for _, name in names],
+        "idf": idf,
+        "unseen_idf": math.log(1 + total) + 1,
+        "postings": postings
+    }
+
+def build_registry_index(registry_list: list) -> dict:
+    """Precompute the lookups find_matching_unit needs for one registry list.
+    
+    Exact and previous-name maps keep the first unit for each name, so
+    lookups return the same unit the registry-order scan would. Blank names
+    are left out, since an empty name is contained in every query.
+    """
+    exact = {}
+    previous_names = {}
+    canonical_names = []
+    term_index = {}
+    scored_names = []
+    
+    for position, unit in enumerate(registry_list):
+        canonical = unit.get("canonical_name", "")
+        if isinstance(canonical, str) and canonical.strip():
+            exact.setdefault(canonical.lower().strip(), unit)
+            canonical_names.append((position, canonical.lower().strip()))
+            for term in set(re.findall(r'\b\w+\b', canonical.lower())):
+                term_index.setdefault(term, []).append(position)
+            scored_names.append((position, canonical.strip()))
+        
+        previous = unit.get("previous_names", "")
+        if previous and isinstance(previous, str):
+            for name in previous.split(";"):
+                if name.strip():
+                    previous_names.setdefault(name.strip().lower(), unit)
+                    scored_names.append((position, name.strip()))
+    
+    return {
+        "trigrams": _build_trigram_index(scored_names),
+        "units": registry_list,
+        "size": len(registry_list),
+        "exact": exact,
+        "previous_names": previous_names,
+        "canonical_names": canonical_names,
+        "term_index": term_index
+    }
+
+def get_registry_index(registry: dict, unit_type: str) -> dict:
+    """Return the index for one registry list, rebuilding it if the list changed."""
+    key = "academic" if unit_type == "Academic" else "administrative"
+    registry_list = registry.get(key, [])
+    indexes = registry.setdefault("index", {})
+    index = indexes.get(key)
+    if index is None or index["units"] is not registry_list or index["size"] != len(registry_list):
+        index = build_registry_index(registry_list)
+        indexes[key] = index
+    return index
+
+def _index_unit_registry(registry: dict):
+    """Build the match indexes for both registry lists."""
+    registry["index"] = {
+        "academic": build_registry_index(registry.get("academic", [])),
+        "administrative": build_registry_index(registry.get("administrative", []))
+    }
+
+def suggest_matching_units(extracted_name: str, unit_type: str, registry: dict,
+                           k: int = UNIT_SUGGESTION_COUNT) -> list:
+    """Rank registry units by trigram TF-IDF similarity to an extracted name.
+    
+    Canonical and previous names are both scored, and each unit takes its
+    best-scoring name. Returns up to k {"unit", "score", "matched_name"}
+    dicts, best first, with scores from 0 to 1.
+    """
+    index = get_registry_index(registry, unit_type)
+    trigrams = index["trigrams"]
+    
+    query = _name_trigrams(extracted_name)
+    weights = {
+        gram: (1 + math.log(tf)) * trigrams["idf"].get(gram, trigrams["unseen_idf"])
+        for gram, tf in query.items()
+    }
+    norm = math.sqrt(sum(w * w for w in weights.values()))
+    if not norm:
+        return []
+    
+    scores = {}
+    for gram, weight in weights.items():
+        for entry, entry_weight in trigrams["postings"].get(gram, []):
+            scores[entry] = scores.get(entry, 0.0) + weight * entry_weight
+    
+    best = {}
+    for entry, score in scores.items():
+        position = trigrams["owners"][entry]
+        if score > best.get(position, (0.0, None))[0]:
+            best[position] = (score, entry)
+    
+    top = heapq.nsmallest(k, best.items(), key=lambda item: (-item[1][0], item[0]))
+    return [
+        {
+            "unit": index["units"][position],
+            "score": round(score / norm, 3),
+            "matched_name": trigrams["names"][entry]
+        }
+        for position, (score, entry) in top
+    ]
+
 def find_matching_unit(extracted_name: str, unit_type: str, registry: dict) -> dict:
     """Find matching unit in registry, checking canonical and previous names."""
-    registry_list = registry.get("academic" if unit_type == "Academic" else "administrative", [])
+    index = get_registry_index(registry, unit_type)
+    registry_list = index["units"]
     
     extracted_lower = extracted_name.lower().strip()
+    if not extracted_lower:
+        return {"match": None, "match_type": "none", "confidence": "none"}
     
     # First pass: exact match on canonical name
-    for unit in registry_list:
-        canonical = unit.get("canonical_name", "").lower().strip()
-        if canonical == extracted_lower:
-            return {"match": unit, "match_type": "exact", "confidence": "high"}
+    unit = index["exact"].get(extracted_lower)
+    if unit is not None:
+        return {"match": unit, "match_type": "exact", "confidence": "high"}
     
     # Second pass: check previous names
-    for unit in registry_list:
-        previous = unit.get("previous_names", "")
-        if previous and isinstance(previous, str):
-            prev_list = [p.strip().lower() for p in previous.split(";")]
-            if extracted_lower in prev_list:
-                return {"match": unit, "match_type": "previous_name", "confidence": "high"}
+    unit = index["previous_names"].get(extracted_lower)
+    if unit is not None:
+        return {"match": unit, "match_type": "previous_name", "confidence": "high"}
     
     # Third pass: fuzzy matching (contains)
-    for unit in registry_list:
-        canonical = unit.get("canonical_name", "").lower().strip()
+    for position, canonical in index["canonical_names"]:
         # Check if one contains the other (handles slight variations)
         if extracted_lower in canonical or canonical in extracted_lower:
-            return {"match": unit, "match_type": "fuzzy", "confidence": "medium"}
+            return {"match": registry_list[position], "match_type": "fuzzy", "confidence": "medium"}
     
-    # Fourth pass: key terms matching
-    extracted_terms = set(re.findall(r'\b\w+\b', extracted_lower))
-    best_match = None
-    best_score = 0
-    
-    for unit in registry_list:
-        canonical = unit.get("canonical_name", "").lower()
-        canonical_terms = set(re.findall(r'\b\w+\b', canonical))
-        
-        # Calculate overlap
-        common = extracted_terms & canonical_terms
-        if len(common) > best_score and len(common) >= 2:
-            best_score = len(common)
-            best_match = unit
+    # Fourth pass: key terms matching, earliest unit wins ties
+    overlap = {}
+    for term in set(re.findall(r'\b\w+\b', extracted_lower)):
+        for position in index["term_index"].get(term, []):
+            overlap[position] = overlap.get(position, 0) + 1
     
-    if best_match and best_score >= 3:
-        return {"match": best_match, "match_type": "terms", "confidence": "low"}
+    if overlap:
+        best_position = min(overlap, key=lambda position: (-overlap[position], position))
+        if overlap[best_position] >= 3:
+            return {"match": registry_list[best_position], "match_type": "terms", "confidence": "low"}
     
     return {"match": None, "match_type": "none", "confidence": "none"}
 
+def resolve_unit_ids(metadata_list: list, registry: dict):
+    """Set unit_id (and canonical_name on a match) on each report's metadata."""
+    for metadata in metadata_list:
+        match = find_matching_unit(
+            metadata.get("unit_name", ""),
+            metadata.get("unit_type", "Academic"),
+            registry
+        )
+        if match["match"]:
+            metadata["unit_id"] = match["match"].get("unit_id")
+            metadata["canonical_name"] = match["match"].get("canonical_name")
+        else:
+            metadata["unit_id"] = generate_unit_id(
+                metadata.get("unit_name", ""),
+                metadata.get("college_division", ""),
+                metadata.get("unit_type", "Academic")
+            )
+
 # ============================================================================
 # EXCEL ONLINE (MICROSOFT GRAPH API) INTEGRATION
 # ============================================================================
 
+@st.cache_resource
+def _graph_token_store() -> dict:
+    """Process-wide MSAL apps and access tokens, shared across sessions and threads."""
+    return {"lock": threading.Lock(), "apps": {}, "tokens": {}}
+
 def get_graph_access_token(client_id: str, client_secret: str, tenant_id: str) -> str:
-    """Get Microsoft Graph API access token using client credentials."""
+    """Get Microsoft Graph API access token using client credentials.
+    
+    Tokens are reused across reruns and sessions until shortly before they
+    expire, so most calls never reach login.microsoftonline.com.
+    """
     if not EXCEL_ONLINE_SUPPORT:
         return None
     
-    try:
-        authority = f"https://login.microsoftonline.com/{tenant_id}"
-        app = msal.ConfidentialClientApplication(
-            client_id,
-            authority=authority,
-            client_credential=client_secret
-        )
-        
-        # Get token for Microsoft Graph
-        result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+    store = _graph_token_store()
+    key = (tenant_id, client_id, hashlib.sha256(client_secret.encode()).hexdigest())
+    
+    cached = store["tokens"].get(key)
+    if cached and cached["expires_at"] - GRAPH_TOKEN_REFRESH_MARGIN > time.time():
+        return cached["access_token"]
+    
+    with store["lock"]:
+        # Another thread may have refreshed the token while we waited
+        cached = store["tokens"].get(key)
+        if cached and cached["expires_at"] - GRAPH_TOKEN_REFRESH_MARGIN > time.time():
+            return cached["access_token"]
         
-        if "access_token" in result:
-            return result["access_token"]
-        else:
-            st.error(f"Failed to get access token: {result.get('error_description', 'Unknown error')}")
-            return None
+        try:
+            app = store["apps"].get(key)
+            if app is None:
+                authority = f"https://login.microsoftonline.com/{tenant_id}"
+                app = msal.ConfidentialClientApplication(
+                    client_id,
+                    authority=authority,
+                    client_credential=client_secret
+                )
+                store["apps"][key] = app
             
-    except Exception as e:
-        st.error(f"Authentication error: {str(e)}")
-        return None
+            # Get token for Microsoft Graph
+            result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+            
+            if "access_token" in result:
+                store["tokens"][key] = {
+                    "access_token": result["access_token"],
+                    "expires_at": time.time() + int(result.get("expires_in", 3600))
+                }
+                return result["access_token"]
+            else:
+                st.error(f"Failed to get access token: {result.get('error_description', 'Unknown error')}")
+                return None
+                
+        except Exception as e:
+            st.error(f"Authentication error: {str(e)}")
+            return None
 
-def get_excel_workbook_info(access_token: str, site_id: str, file_path: str) -> dict:
-    """Get workbook information from SharePoint/OneDrive."""
+@st.cache_resource
+def _graph_http() -> dict:
+    """Process-wide pooled Graph session and per-endpoint latency metrics."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=GRAPH_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return {"session": session, "lock": threading.Lock(), "metrics": {}}
+
+def _graph_endpoint(url: str) -> str:
+    """Collapse a Graph URL into a short endpoint name for metrics."""
+    path = url.split("?")[0]
+    if path.endswith("/$batch"):
+        return "$batch"
+    if path.endswith("/usedRange"):
+        return "usedRange"
+    if "/range(" in path:
+        return "range"
+    if path.endswith("/worksheets"):
+        return "worksheets"
+    if "/workbook" not in path:
+        return "driveItem"
+    return "workbook"
+
+def _graph_metrics_entry(metrics: dict, endpoint: str) -> dict:
+    return metrics.setdefault(endpoint, {
+        "requests": 0, "errors": 0, "retries": 0, "total_seconds": 0.0, "max_seconds": 0.0
+    })
+
+def _record_graph_latency(endpoint: str, seconds: float, error: bool):
+    http = _graph_http()
+    with http["lock"]:
+        entry = _graph_metrics_entry(http["metrics"], endpoint)
+        entry["requests"] += 1
+        entry["errors"] += int(error)
+        entry["total_seconds"] += seconds
+        entry["max_seconds"] = max(entry["max_seconds"], seconds)
+
+def _record_graph_retry(endpoint: str):
+    http = _graph_http()
+    with http["lock"]:
+        _graph_metrics_entry(http["metrics"], endpoint)["retries"] += 1
+
+def get_graph_metrics() -> dict:
+    """Return a snapshot of per-endpoint Graph request metrics."""
+    http = _graph_http()
+    with http["lock"]:
+        return {endpoint: dict(entry) for endpoint, entry in http["metrics"].items()}
+
+def _graph_retry_delay(retry_after, attempt: int) -> float:
+    """Honor Retry-After when present, else back off exponentially with jitter."""
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = GRAPH_BACKOFF_BASE * (2 ** attempt) + random.uniform(0, GRAPH_BACKOFF_BASE)
+    return min(max(delay, 0.0), GRAPH_MAX_BACKOFF)
+
+def graph_request(method: str, url: str, access_token: str, json_body=None) -> "requests.Response":
+    """Send a Graph request on the pooled session with timeouts and retries.
+    
+    429/503 throttling responses are retried after Retry-After (or exponential
+    backoff); connection errors are retried only for idempotent methods.
+    """
+    http = _graph_http()
+    endpoint = _graph_endpoint(url)
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json"
     }
     
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        start = time.monotonic()
+        try:
+            response = http["session"].request(
+                method, url, headers=headers, json=json_body, timeout=GRAPH_TIMEOUT
+            )
+        except requests.ConnectionError:
+            _record_graph_latency(endpoint, time.monotonic() - start, error=True)
+            if method == "POST" or attempt == GRAPH_MAX_RETRIES:
+                raise
+            _record_graph_retry(endpoint)
+            time.sleep(_graph_retry_delay(None, attempt))
+            continue
+        except requests.RequestException:
+            _record_graph_latency(endpoint, time.monotonic() - start, error=True)
+            raise
+        
+        _record_graph_latency(endpoint, time.monotonic() - start, error=response.status_code >= 400)
+        if response.status_code in GRAPH_RETRY_STATUSES and attempt < GRAPH_MAX_RETRIES:
+            _record_graph_retry(endpoint)
+            time.sleep(_graph_retry_delay(response.headers.get("Retry-After"), attempt))
+            continue
+        return response
+
+def get_excel_workbook_info(access_token: str, site_id: str, file_path: str) -> dict:
+    """Get workbook information from SharePoint/OneDrive."""
     # If site_id is provided, use SharePoint; otherwise use OneDrive
     if site_id:
         # SharePoint path
-        base_url = f"https://graph.microsoft.com/v1.0/sites/{site_id}/drive/root:/{file_path}"
+        base_url = f"{GRAPH_BASE_URL}/sites/{site_id}/drive/root:/{file_path}"
     else:
         # OneDrive path (for the app's service account)
-        base_url = f"https://graph.microsoft.com/v1.0/drive/root:/{file_path}"
+        base_url = f"{GRAPH_BASE_URL}/drive/root:/{file_path}"
     
     try:
-        response = requests.get(base_url, headers=headers)
+        response = graph_request("GET", base_url, access_token)
         if response.status_code == 200:
             return response.json()
         else:
@@ -1134,304 +1789,1171 @@ def get_excel_workbook_info(access_token: str, site_id: str, file_path: str) ->
     except Exception as e:
         return {"error": str(e)}
 
-def get_or_create_worksheet(access_token: str, drive_id: str, item_id: str, sheet_name: str, headers_list: list) -> bool:
-    """Get existing worksheet or create with headers."""
-    api_headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    base_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/workbook/worksheets"
-    
-    try:
-        # Check if worksheet exists
-        response = requests.get(base_url, headers=api_headers)
-        if response.status_code != 200:
-            return False
+def _count_request(stats: dict):
+    """Increment the request counter in an optional stats dict."""
+    if stats is not None:
+        stats["requests"] = stats.get("requests", 0) + 1
+
+def _column_letter(column_number: int) -> str:
+    """Convert a 1-based column number to an Excel column letter (1 -> A, 27 -> AA)."""
+    letters = ""
+    while column_number > 0:
+        column_number, remainder = divmod(column_number - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def graph_batch(access_token: str, sub_requests: list, sequential: bool = False,
+                stats: dict = None) -> list:
+    """Send Graph sub-requests through JSON $batch, up to 20 per round trip.
+    
+    Each sub-request is {"method", "url"} with an optional "body"; urls are
+    relative to GRAPH_BASE_URL. With sequential=True each sub-request depends
+    on the one before it, so writes apply in order. Returns one
+    {"status", "body", "headers"} dict per sub-request, in the same order.
+    """
+    responses = []
+    for chunk_start in range(0, len(sub_requests), GRAPH_BATCH_MAX_REQUESTS):
+        chunk = sub_requests[chunk_start:chunk_start + GRAPH_BATCH_MAX_REQUESTS]
+        responses.extend(_send_batch_chunk(access_token, chunk, sequential, stats))
+    return responses
+
+def _send_batch_chunk(access_token: str, chunk: list, sequential: bool, stats: dict) -> list:
+    """Send one $batch request, resending any throttled sub-requests."""
+    results = [None] * len(chunk)
+    pending = list(range(len(chunk)))
+    
+    for attempt in range(GRAPH_MAX_RETRIES + 1):
+        payload = []
+        for n, index in enumerate(pending):
+            sub = chunk[index]
+            item = {"id": str(index + 1), "method": sub["method"], "url": sub["url"]}
+            if "body" in sub:
+                item["body"] = sub["body"]
+                item["headers"] = {"Content-Type": "application/json"}
+            if sequential and n > 0:
+                item["dependsOn"] = [str(pending[n - 1] + 1)]
+            payload.append(item)
         
-        worksheets = response.json().get("value", [])
-        sheet_exists = any(ws.get("name") == sheet_name for ws in worksheets)
+        by_id = {}
+        failure = {"status": 0, "body": {"error": {"message": "No response"}}}
+        _count_request(stats)
+        if stats is not None:
+            stats["subrequests"] = stats.get("subrequests", 0) + len(payload)
+        try:
+            response = graph_request("POST", f"{GRAPH_BASE_URL}/$batch", access_token, json_body={"requests": payload})
+            if response.status_code == 200:
+                by_id = {r.get("id"): r for r in response.json().get("responses", [])}
+            else:
+                failure = {"status": response.status_code, "body": {"error": {"message": response.text}}}
+        except Exception as e:
+            failure = {"status": 0, "body": {"error": {"message": str(e)}}}
         
-        if not sheet_exists:
-            # Create worksheet
-            create_response = requests.post(
-                base_url,
-                headers=api_headers,
-                json={"name": sheet_name}
-            )
-            if create_response.status_code not in [200, 201]:
-                st.error(f"Failed to create worksheet: {create_response.text}")
-                return False
-            
-            # Add headers to new worksheet
-            header_range = f"A1:{chr(65 + len(headers_list) - 1)}1"
-            range_url = f"{base_url}/{sheet_name}/range(address='{header_range}')"
-            
-            update_response = requests.patch(
-                range_url,
-                headers=api_headers,
-                json={"values": [headers_list]}
-            )
-            if update_response.status_code not in [200, 201]:
-                st.warning(f"Created worksheet but failed to add headers: {update_response.text}")
+        for item in payload:
+            result = by_id.get(item["id"], failure)
+            results[int(item["id"]) - 1] = {
+                "status": result.get("status", 0),
+                "body": result.get("body") or {},
+                "headers": {k.lower(): v for k, v in (result.get("headers") or {}).items()}
+            }
         
-        return True
+        throttled = [i for i in pending if results[i]["status"] in GRAPH_RETRY_STATUSES]
+        if not throttled or attempt == GRAPH_MAX_RETRIES:
+            break
         
-    except Exception as e:
-        st.error(f"Error managing worksheet: {str(e)}")
+        # Ordered writes resume from the first throttled one, since everything
+        # after it failed its dependency
+        pending = [i for i in pending if i >= throttled[0]] if sequential else throttled
+        _record_graph_retry("$batch")
+        time.sleep(max(_graph_retry_delay(results[i]["headers"].get("retry-after"), attempt) for i in throttled))
+    
+    return results
+
+def graph_error_message(response: dict) -> str:
+    """Summarize a failed Graph (sub-)response for display."""
+    body = response.get("body")
+    error = body.get("error", {}) if isinstance(body, dict) else {}
+    return f"{response.get('status')} {error.get('code', '')} {error.get('message', '')}".strip()
+
+def _records_from_values(values: list) -> list:
+    """Convert a usedRange values grid into records keyed by the header row."""
+    if len(values) > 1:
+        headers = values[0]
+        records = []
+        for row in values[1:]:
+            record = {}
+            for i, header in enumerate(headers):
+                record[header] = row[i] if i < len(row) else ""
+            records.append(record)
+        return records
+    return []
+
+def _create_worksheet(access_token: str, drive_id: str, item_id: str, sheet_name: str,
+                      headers_list: list, stats: dict = None) -> bool:
+    """Create a worksheet and write its header row in one batched round trip."""
+    worksheets_path = f"/drives/{drive_id}/items/{item_id}/workbook/worksheets"
+    header_range = f"A1:{_column_letter(len(headers_list))}1"
+    
+    create_response, header_response = graph_batch(access_token, [
+        {"method": "POST", "url": worksheets_path, "body": {"name": sheet_name}},
+        {"method": "PATCH", "url": f"{worksheets_path}/{sheet_name}/range(address='{header_range}')",
+         "body": {"values": [headers_list]}}
+    ], sequential=True, stats=stats)
+    
+    if create_response["status"] not in [200, 201]:
+        st.error(f"Failed to create worksheet: {graph_error_message(create_response)}")
         return False
+    if header_response["status"] not in [200, 201]:
+        st.warning(f"Created worksheet but failed to add headers: {graph_error_message(header_response)}")
+    return True
 
-def get_worksheet_data(access_token: str, drive_id: str, item_id: str, sheet_name: str) -> list:
-    """Get all data from a worksheet."""
-    api_headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-    
-    url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/workbook/worksheets/{sheet_name}/usedRange"
+@st.cache_resource
+def _worksheet_cache() -> dict:
+    """Process-wide parsed worksheet records, keyed by (drive, item, sheet).
     
+    "written" holds sheets changed by this server since they were last
+    downloaded (sheet None for a whole workbook); their next read skips the
+    disk snapshots, whose workbook version may not have caught up yet.
+    """
+    return {"lock": threading.Lock(), "entries": {}, "written": set()}
+
+def get_workbook_version(access_token: str, drive_id: str, item_id: str, stats: dict = None):
+    """Return the workbook's content tag (cTag, else eTag), or None if unavailable."""
+    url = f"{GRAPH_BASE_URL}/drives/{drive_id}/items/{item_id}?$select=eTag,cTag"
     try:
-        response = requests.get(url, headers=api_headers)
+        _count_request(stats)
+        response = graph_request("GET", url, access_token)
         if response.status_code == 200:
-            data = response.json()
-            values = data.get("values", [])
-            if len(values) > 1:
-                headers = values[0]
-                records = []
-                for row in values[1:]:
-                    record = {}
-                    for i, header in enumerate(headers):
-                        record[header] = row[i] if i < len(row) else ""
-                    records.append(record)
-                return records
-            return []
-        else:
-            return []
-    except Exception as e:
-        return []
-
-def save_metadata_to_excel_online(access_token: str, drive_id: str, item_id: str, 
-                                   metadata_rows: list, report_type: str) -> bool:
-    """Save metadata to appropriate worksheet in Excel Online, handling duplicates."""
+            item = response.json()
+            return item.get("cTag") or item.get("eTag")
+    except Exception:
+        pass
+    return None
+
+def invalidate_worksheet_cache(drive_id: str, item_id: str, sheet_name: str = None):
+    """Drop cached records for one sheet, or every sheet of a workbook.
+    
+    Used after this server writes a sheet. Excel Online may keep reporting
+    the old cTag for a while, so disk snapshots saved under it are deleted
+    and the next read downloads the sheet even if the version looks unchanged.
+    """
+    cache = _worksheet_cache()
+    with cache["lock"]:
+        cache["written"].add((drive_id, item_id, sheet_name))
+        for key in list(cache["entries"]):
+            if key[:2] == (drive_id, item_id) and (sheet_name is None or key[2] == sheet_name):
+                entry = cache["entries"].pop(key)
+                if entry["version"]:
+                    try:
+                        os.remove(_disk_cache_path("worksheets", cache_key(*key, entry["version"])))
+                    except OSError:
+                        pass
+
+def worksheet_cache_info() -> dict:
+    """Summarize the in-memory worksheet cache for the admin panel."""
+    cache = _worksheet_cache()
+    with cache["lock"]:
+        entries = list(cache["entries"].values())
+    return {"sheets": len(entries), "rows": sum(len(e["records"]) for e in entries)}
+
+def _fetch_worksheet_records(access_token: str, drive_id: str, item_id: str, sheet_name: str,
+                             stats: dict = None):
+    """Download a worksheet's usedRange as records, or None on failure."""
+    url = f"{GRAPH_BASE_URL}/drives/{drive_id}/items/{item_id}/workbook/worksheets/{sheet_name}/usedRange"
+    try:
+        _count_request(stats)
+        response = graph_request("GET", url, access_token)
+        if response.status_code == 200:
+            return _records_from_values(response.json().get("values", []))
+    except Exception:
+        pass
+    return None
+
+def _load_worksheet_entry(access_token: str, drive_id: str, item_id: str, sheet_name: str,
+                          stats: dict = None):
+    """Return the cache entry for a sheet, refreshing it if the workbook changed.
+    
+    Records are reused as-is within WORKSHEET_CACHE_TTL seconds; after that
+    the workbook's cTag is checked and the sheet is only downloaded again if
+    the workbook changed. Returns None if the sheet could not be read.
+    """
+    cache = _worksheet_cache()
+    key = (drive_id, item_id, sheet_name)
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+    
+    if entry and time.monotonic() - entry["checked_at"] < WORKSHEET_CACHE_TTL:
+        record_cache_event("worksheets", hit=True)
+        return entry
+    
+    version = get_workbook_version(access_token, drive_id, item_id, stats)
+    if entry and version is not None and version == entry["version"]:
+        entry["checked_at"] = time.monotonic()
+        record_cache_event("worksheets", hit=True)
+        return entry
+    
+    with cache["lock"]:
+        written = bool(cache["written"] & {key, (drive_id, item_id, None)})
+    
+    records = None
+    disk_key = cache_key(drive_id, item_id, sheet_name, version) if version else None
+    if disk_key and WORKSHEET_CACHE_MAX_BYTES > 0 and not written:
+        records = disk_cache_get("worksheets", disk_key)
+    record_cache_event("worksheets", hit=records is not None)
+    
+    if records is None:
+        records = _fetch_worksheet_records(access_token, drive_id, item_id, sheet_name, stats)
+        if records is None:
+            return None
+        # Replaces any snapshot saved under this version before our own write
+        if disk_key and WORKSHEET_CACHE_MAX_BYTES > 0:
+            disk_cache_put("worksheets", disk_key, records, WORKSHEET_CACHE_MAX_BYTES)
+        with cache["lock"]:
+            cache["written"].discard(key)
+    
+    # Without a version we can still reuse the records for the TTL window
+    entry = {"records": records, "version": version, "checked_at": time.monotonic()}
+    with cache["lock"]:
+        cache["entries"][key] = entry
+    return entry
+
+def get_worksheet_data(access_token: str, drive_id: str, item_id: str, sheet_name: str,
+                       stats: dict = None, use_cache: bool = True) -> list:
+    """Get all data from a worksheet, through the per-workbook read cache."""
+    if not use_cache:
+        return _fetch_worksheet_records(access_token, drive_id, item_id, sheet_name, stats) or []
+    
+    entry = _load_worksheet_entry(access_token, drive_id, item_id, sheet_name, stats)
+    return list(entry["records"]) if entry else []
+
+def load_sheet_for_save(access_token: str, drive_id: str, item_id: str, sheet_name: str,
+                        headers_list: list, stats: dict = None):
+    """Check the worksheet and read its rows in one round trip, creating it if missing.
+    
+    Returns the existing records, or None if the sheet could not be read.
+    """
+    worksheets_path = f"/drives/{drive_id}/items/{item_id}/workbook/worksheets"
+    check_response, used_response = graph_batch(access_token, [
+        {"method": "GET", "url": worksheets_path},
+        {"method": "GET", "url": f"{worksheets_path}/{sheet_name}/usedRange"}
+    ], stats=stats)
+    
+    if check_response["status"] != 200:
+        st.error(f"Could not read worksheets: {graph_error_message(check_response)}")
+        return None
     
-    api_headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    worksheets = check_response["body"].get("value", [])
+    if not any(ws.get("name") == sheet_name for ws in worksheets):
+        if not _create_worksheet(access_token, drive_id, item_id, sheet_name, headers_list, stats=stats):
+            return None
+        return []
     
-    # Determine sheet name and headers based on report type
+    if used_response["status"] != 200:
+        # Never guess row positions from an unreadable sheet
+        st.error(f"Could not read {sheet_name}: {graph_error_message(used_response)}")
+        return None
+    return _records_from_values(used_response["body"].get("values", []))
+
+def get_sheet_schema(report_type: str) -> tuple:
+    """Return (sheet name, column headers) for a report type."""
     if report_type == "Results Report":
-        sheet_name = "Results_Data"
-        headers = [
-            "unit_id", "unit_type", "unit_name", "college_division", "degree_level",
-            "modality", "academic_year", "report_type", "outcome_id", "outcome_text",
-            "outcome_label", "related_competency_or_function", "strategic_plan_theme",
-            "core_objective", "assessment_method", "assessment_method_normalized",
-            "sample_size", "benchmark", "result_value", "achievement_level",
-            "gap_from_benchmark", "proposed_improvement", "responsible_party",
-            "improvement_timeline", "upload_timestamp", "last_updated"
-        ]
+        return "Results_Data", RESULTS_SHEET_HEADERS
     elif report_type == "Improvement Report":
-        sheet_name = "Improvement_Data"
-        headers = [
-            "unit_id", "unit_type", "unit_name", "college_division",
-            "academic_year", "report_type", "outcome_id", "improvement_action_taken",
-            "connection_to_previous", "previous_proposal_text",
-            "upload_timestamp", "last_updated"
-        ]
+        return "Improvement_Data", IMPROVEMENT_SHEET_HEADERS
     else:  # Next Cycle Plan
-        sheet_name = "Plan_Data"
-        headers = [
-            "unit_id", "unit_type", "unit_name", "college_division", "degree_level",
-            "academic_year", "report_type", "outcome_id", "outcome_text",
-            "outcome_label", "related_competency_or_function", "strategic_plan_theme",
-            "core_objective", "planned_method", "planned_benchmark",
-            "action_steps", "responsible_party", "upload_timestamp", "last_updated"
-        ]
-    
-    # Ensure worksheet exists
-    if not get_or_create_worksheet(access_token, drive_id, item_id, sheet_name, headers):
-        return False
+        return "Plan_Data", PLAN_SHEET_HEADERS
+
+def _row_key(row: dict) -> str:
+    return f"{row.get('unit_id', '')}|{row.get('academic_year', '')}|{row.get('outcome_id', '')}"
+
+def plan_sheet_writes(existing_data: list, metadata_rows: list, headers: list) -> dict:
+    """Work out which sheet rows a save changes, as {row number: values}.
     
-    try:
-        # Get existing data
-        existing_data = get_worksheet_data(access_token, drive_id, item_id, sheet_name)
-        
-        # Build index of existing rows by unique key
-        existing_index = {}
-        for i, row in enumerate(existing_data):
-            key = f"{row.get('unit_id', '')}|{row.get('academic_year', '')}|{row.get('outcome_id', '')}"
-            existing_index[key] = i + 2  # +2 for header row and 1-based indexing
-        
-        # Track keys for orphan detection
-        new_keys = set()
-        unit_year_combos = set()
-        
-        rows_to_update = []
-        rows_to_append = []
-        
-        for row in metadata_rows:
-            key = f"{row.get('unit_id', '')}|{row.get('academic_year', '')}|{row.get('outcome_id', '')}"
-            new_keys.add(key)
-            unit_year_combos.add(f"{row.get('unit_id', '')}|{row.get('academic_year', '')}")
-            
-            # Prepare row data in header order
-            row_data = [str(row.get(h, "")) for h in headers]
-            
-            if key in existing_index:
-                rows_to_update.append({
-                    "row_num": existing_index[key],
-                    "data": row_data
-                })
-            else:
-                rows_to_append.append(row_data)
-        
-        base_url = f"https://graph.microsoft.com/v1.0/drives/{drive_id}/items/{item_id}/workbook/worksheets/{sheet_name}"
-        
-        # Update existing rows
-        for update in rows_to_update:
-            row_num = update["row_num"]
-            range_address = f"A{row_num}:{chr(65 + len(headers) - 1)}{row_num}"
-            range_url = f"{base_url}/range(address='{range_address}')"
-            
-            response = requests.patch(
-                range_url,
-                headers=api_headers,
-                json={"values": [update["data"]]}
-            )
-            if response.status_code not in [200, 201]:
-                st.warning(f"Failed to update row {row_num}")
-        
-        # Append new rows
-        if rows_to_append:
-            # Find the next empty row
-            next_row = len(existing_data) + 2  # +1 for header, +1 for 1-based
-            
-            for i, row_data in enumerate(rows_to_append):
-                row_num = next_row + i
-                range_address = f"A{row_num}:{chr(65 + len(headers) - 1)}{row_num}"
-                range_url = f"{base_url}/range(address='{range_address}')"
-                
-                response = requests.patch(
-                    range_url,
-                    headers=api_headers,
-                    json={"values": [row_data]}
-                )
-        
-        # Delete orphaned outcomes (same unit+year but outcome not in new data)
-        rows_to_delete = []
-        for key, row_num in existing_index.items():
-            parts = key.split("|")
-            if len(parts) >= 2:
-                unit_year = f"{parts[0]}|{parts[1]}"
-                if unit_year in unit_year_combos and key not in new_keys:
-                    rows_to_delete.append(row_num)
-        
-        # Delete from bottom up (to preserve row numbers)
-        for row_num in sorted(rows_to_delete, reverse=True):
-            # Clear the row (Excel Online doesn't have direct row delete via Graph API easily)
-            range_address = f"A{row_num}:{chr(65 + len(headers) - 1)}{row_num}"
-            range_url = f"{base_url}/range(address='{range_address}')"
-            
-            # Clear the row content
-            requests.patch(
-                range_url,
-                headers=api_headers,
-                json={"values": [[""] * len(headers)]}
-            )
+    Rows are matched on unit|year|outcome: matches are updated in place, new
+    rows are appended, and existing outcomes for the same unit+year that are
+    missing from metadata_rows are cleared as orphans.
+    """
+    # Build index of existing rows by unique key
+    existing_index = {}
+    for i, row in enumerate(existing_data):
+        existing_index[_row_key(row)] = i + 2  # +2 for header row and 1-based indexing
+    
+    # Track keys for orphan detection
+    new_keys = set()
+    unit_year_combos = set()
+    
+    writes = {}
+    next_row = len(existing_data) + 2  # +1 for header, +1 for 1-based
+    
+    for row in metadata_rows:
+        key = _row_key(row)
+        new_keys.add(key)
+        unit_year_combos.add(f"{row.get('unit_id', '')}|{row.get('academic_year', '')}")
         
-        return True
+        # Prepare row data in header order
+        row_data = [str(row.get(h, "")) for h in headers]
         
-    except Exception as e:
-        st.error(f"Error saving to Excel Online: {str(e)}")
-        return False
+        if key in existing_index:
+            writes[existing_index[key]] = row_data
+        else:
+            writes[next_row] = row_data
+            next_row += 1
+    
+    # Clear orphaned outcomes (same unit+year but outcome not in new data).
+    # Excel Online doesn't have direct row delete via Graph API easily.
+    for key, row_num in existing_index.items():
+        parts = key.split("|")
+        if len(parts) >= 2:
+            unit_year = f"{parts[0]}|{parts[1]}"
+            if unit_year in unit_year_combos and key not in new_keys:
+                writes[row_num] = [""] * len(headers)
+    
+    return writes
+
+def coalesce_row_writes(writes: dict, existing_data: list, headers: list,
+                        max_gap: int = None, max_rows: int = None) -> list:
+    """Group row writes into as few contiguous ranges as possible.
+    
+    Adjacent rows always share a range. With max_gap > 0, runs separated by
+    up to that many untouched rows are joined too, by rewriting the rows in
+    between with the values read before the save; that turns formulas in
+    those rows into static values and undoes edits made there since the
+    read, so it is off unless BULK_WRITE_MAX_GAP is set. Returns a list of
+    (first row number, 2D values) with at most max_rows rows each.
+    """
+    max_gap = BULK_WRITE_MAX_GAP if max_gap is None else max_gap
+    max_rows = BULK_WRITE_MAX_ROWS if max_rows is None else max_rows
+    
+    ranges = []
+    current_start = None
+    current_values = []
+    
+    for row_num in sorted(writes):
+        if current_start is not None:
+            last_row = current_start + len(current_values) - 1
+            gap = row_num - last_row - 1
+            if gap <= max_gap and len(current_values) + gap + 1 <= max_rows:
+                # Bridge the gap with the rows' existing contents
+                for filler_row in range(last_row + 1, row_num):
+                    record = existing_data[filler_row - 2] if filler_row - 2 < len(existing_data) else {}
+                    current_values.append([record.get(h, "") for h in headers])
+                current_values.append(writes[row_num])
+                continue
+            ranges.append((current_start, current_values))
+        current_start = row_num
+        current_values = [writes[row_num]]
+    
+    if current_start is not None:
+        ranges.append((current_start, current_values))
+    return ranges
+
+def _write_planned_rows(access_token: str, drive_id: str, item_id: str, sheet_name: str,
+                        headers: list, writes: dict, existing_data: list, stats: dict) -> set:
+    """Send planned row writes as coalesced range updates in ordered $batch calls.
+    
+    Returns the row numbers whose range update failed (empty on success).
+    """
+    ranges = coalesce_row_writes(writes, existing_data, headers)
+    
+    sheet_path = f"/drives/{drive_id}/items/{item_id}/workbook/worksheets/{sheet_name}"
+    last_column = _column_letter(len(headers))
+    
+    sub_requests = []
+    for first_row, values in ranges:
+        range_address = f"A{first_row}:{last_column}{first_row + len(values) - 1}"
+        sub_requests.append({
+            "method": "PATCH",
+            "url": f"{sheet_path}/range(address='{range_address}')",
+            "body": {"values": values},
+            "address": range_address
+        })
+    
+    responses = graph_batch(access_token, sub_requests, sequential=True, stats=stats)
+    # Excel Online may not bump the workbook cTag right away, so don't rely on it
+    invalidate_worksheet_cache(drive_id, item_id, sheet_name)
+    failed_rows = set()
+    for (first_row, values), sub_request, response in zip(ranges, sub_requests, responses):
+        if response["status"] not in [200, 201]:
+            st.warning(f"Failed to update rows {sub_request['address']}: {graph_error_message(response)}")
+            failed_rows.update(range(first_row, first_row + len(values)))
+        else:
+            stats["rows_written"] = stats.get("rows_written", 0) + len(values)
+    return failed_rows
 
-def get_historical_data_excel(access_token: str, drive_id: str, item_id: str, 
-                               unit_id: str, outcome_id: str = None) -> list:
-    """Retrieve historical data for stagnation detection and context."""
+def save_metadata_to_excel_online(access_token: str, drive_id: str, item_id: str, 
+                                   metadata_rows: list, report_type: str, stats: dict = None) -> bool:
+    """Save metadata to appropriate worksheet in Excel Online, handling duplicates.
+    
+    The worksheet check and read share one $batch round trip, and changed rows
+    go out as a few multi-row range updates in another. If stats is given, it
+    receives the number of Graph requests issued and rows written.
+    """
+    
+    if stats is None:
+        stats = {}
+    stats.setdefault("requests", 0)
+    
+    # Determine sheet name and headers based on report type
+    sheet_name, headers = get_sheet_schema(report_type)
+    
     try:
-        data = get_worksheet_data(access_token, drive_id, item_id, "Results_Data")
-        
-        # Filter by unit_id
-        filtered = [r for r in data if r.get("unit_id") == unit_id]
-        
-        # If outcome_id specified, filter further
-        if outcome_id:
-            filtered = [r for r in filtered if r.get("outcome_id") == outcome_id]
+        # Ensure worksheet exists and get existing data
+        existing_data = load_sheet_for_save(access_token, drive_id, item_id, sheet_name, headers, stats=stats)
+        if existing_data is None:
+            return False
         
-        return filtered
+        writes = plan_sheet_writes(existing_data, metadata_rows, headers)
+        failed_rows = _write_planned_rows(access_token, drive_id, item_id, sheet_name, headers,
+                                          writes, existing_data, stats)
+        return not failed_rows
         
     except Exception as e:
-        return []
+        st.error(f"Error saving to Excel Online: {str(e)}")
+        return False
 
-def get_previous_improvements_excel(access_token: str, drive_id: str, item_id: str, unit_id: str) -> list:
-    """Get proposed improvements from previous Results reports."""
-    historical = get_historical_data_excel(access_token, drive_id, item_id, unit_id)
+def plan_batch_sheet_writes(existing_data: list, reports_rows: list, headers: list,
+                            report_row_numbers: list = None) -> dict:
+    """Plan writes for several reports as if each had been saved in turn.
     
-    # Sort by academic year descending
-    historical.sort(key=lambda x: x.get("academic_year", ""), reverse=True)
-    
-    improvements = []
-    for record in historical:
-        if record.get("proposed_improvement"):
-            improvements.append({
-                "academic_year": record.get("academic_year"),
-                "outcome_id": record.get("outcome_id"),
-                "proposed_improvement": record.get("proposed_improvement")
-            })
+    Each report is planned with plan_sheet_writes against the sheet as the
+    previous reports left it, so upserts, appends and orphan clearing match
+    one-at-a-time saves. Returns the merged {row number: values}; if
+    report_row_numbers is given, it receives the set of rows each report
+    writes.
+    """
+    current = list(existing_data)
+    writes = {}
+    
+    for metadata_rows in reports_rows:
+        report_writes = plan_sheet_writes(current, metadata_rows, headers)
+        if report_row_numbers is not None:
+            report_row_numbers.append(set(report_writes))
+        for row_num, values in sorted(report_writes.items()):
+            record = dict(zip(headers, values))
+            if row_num - 2 < len(current):
+                current[row_num - 2] = record
+            else:
+                current.append(record)
+        writes.update(report_writes)
+        
+        # usedRange leaves out trailing blank rows, so the next save would too
+        while current and not any(current[-1].get(h, "") for h in headers):
+            current.pop()
     
-    return improvements
-
-# ============================================================================
-# STAGNATION DETECTION
-# ============================================================================
+    return writes
 
-def check_stagnation(access_token: str, drive_id: str, item_id: str, unit_id: str, 
-                     outcome_id: str, current_method: str, current_year: str) -> dict:
-    """Check if outcome has been achieved with same methodology for 3+ years."""
+def save_reports_to_excel_online(access_token: str, drive_id: str, item_id: str,
+                                 reports_rows: list, report_type: str, stats: dict = None) -> list:
+    """Save many reports' rows with one sheet read and a few bulk writes.
     
-    historical = get_historical_data_excel(access_token, drive_id, item_id, unit_id, outcome_id)
-    
-    if len(historical) < 2:  # Need at least 2 previous years
-        return {"stagnant": False, "reason": "insufficient_history"}
+    reports_rows holds one prepare_rows_for_sheet result per report. The
+    outcome matches saving each report in turn with
+    save_metadata_to_excel_online. Returns one flag per report, True only
+    if every row it writes reached the sheet.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("requests", 0)
     
-    # Sort by academic year
-    historical.sort(key=lambda x: x.get("academic_year", ""))
+    sheet_name, headers = get_sheet_schema(report_type)
     
-    # Get last 3 years including current
-    recent = historical[-3:] if len(historical) >= 3 else historical
+    try:
+        existing_data = load_sheet_for_save(access_token, drive_id, item_id, sheet_name, headers, stats=stats)
+        if existing_data is None:
+            return [False] * len(reports_rows)
+        
+        report_row_numbers = []
+        writes = plan_batch_sheet_writes(existing_data, reports_rows, headers, report_row_numbers)
+        failed_rows = _write_planned_rows(access_token, drive_id, item_id, sheet_name, headers,
+                                          writes, existing_data, stats)
+        return [not (row_numbers & failed_rows) for row_numbers in report_row_numbers]
+        
+    except Exception as e:
+        st.error(f"Error saving to Excel Online: {str(e)}")
+        return [False] * len(reports_rows)
+
+def build_history_index(records: list) -> dict:
+    """Index Results_Data records by unit and by (unit, outcome).
     
-    # Check if all achieved
-    all_achieved = all(
-        r.get("achievement_level") == "Fully Achieved" 
-        for r in recent
-    )
+    by_unit keeps sheet order; by_unit_outcome is sorted by academic year.
+    """
+    by_unit = {}
+    for record in records:
+        by_unit.setdefault(record.get("unit_id"), []).append(record)
     
-    if not all_achieved:
-        return {"stagnant": False, "reason": "not_all_achieved"}
+    by_unit_outcome = {}
+    # Years may load as numbers or text, so compare them as text
+    for record in sorted(records, key=lambda x: str(x.get("academic_year", ""))):
+        by_unit_outcome.setdefault((record.get("unit_id"), record.get("outcome_id")), []).append(record)
     
-    # Check methodology similarity (will be evaluated by AI in analysis)
-    methods = [r.get("assessment_method_normalized", r.get("assessment_method", "")) for r in recent]
+    return {"by_unit": by_unit, "by_unit_outcome": by_unit_outcome}
+
+def get_history_index(access_token: str, drive_id: str, item_id: str) -> dict:
+    """Return the history index for the workbook's current Results_Data snapshot.
     
-    return {
-        "stagnant": True,
-        "years_achieved": len(recent),
-        "years": [r.get("academic_year") for r in recent],
-        "methods": methods,
-        "needs_ai_verification": True
-    }
+    The index is built once per cached snapshot and reused until the sheet
+    is downloaded again.
+    """
+    entry = _load_worksheet_entry(access_token, drive_id, item_id, "Results_Data")
+    if entry is None:
+        return build_history_index([])
+    if "history_index" not in entry:
+        entry["history_index"] = build_history_index(entry["records"])
+    return entry["history_index"]
 
 # ============================================================================
-# METADATA EXTRACTION
+# LOCAL WORKBOOK STORAGE
 # ============================================================================
 
-def extract_metadata_with_ai(report_text: str, report_type: str, api_key: str) -> dict:
-    """Use Claude to extract structured metadata from report."""
+@st.cache_resource
+def _local_workbook_store() -> dict:
+    """Process-wide parsed sheets and sync status for local workbooks, keyed by path."""
+    return {"lock": threading.Lock(), "sync_lock": threading.Lock(), "entries": {}, "sync": {}}
+
+def _local_workbook_stamp(path: str):
+    """Return (mtime, size) for a workbook file, or None if it doesn't exist yet."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _worksheet_values(worksheet) -> list:
+    """Read an openpyxl worksheet as a usedRange-style values grid."""
+    values = [["" if value is None else value for value in row] for row in worksheet.iter_rows(values_only=True)]
+    # Like usedRange, leave out trailing blank rows
+    while values and not any(value != "" for value in values[-1]):
+        values.pop()
+    return values
+
+def _load_local_workbook_entry(path: str) -> dict:
+    """Return {"stamp", "sheets"} for a local workbook, re-reading it only after it changes."""
+    store = _local_workbook_store()
+    stamp = _local_workbook_stamp(path)
+    with store["lock"]:
+        entry = store["entries"].get(path)
+    if entry and entry["stamp"] == stamp:
+        return entry
+    
+    sheets = {}
+    if stamp is not None:
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                sheets[worksheet.title] = _records_from_values(_worksheet_values(worksheet))
+        finally:
+            workbook.close()
+    
+    entry = {"stamp": stamp, "sheets": sheets}
+    with store["lock"]:
+        store["entries"][path] = entry
+    return entry
+
+def get_local_worksheet_data(path: str, sheet_name: str) -> list:
+    """Get all records from a sheet of the local workbook ([] if it doesn't exist)."""
+    return list(_load_local_workbook_entry(path)["sheets"].get(sheet_name, []))
+
+def get_local_history_index(path: str) -> dict:
+    """Return the history index for the local workbook's Results_Data sheet."""
+    entry = _load_local_workbook_entry(path)
+    if "history_index" not in entry:
+        entry["history_index"] = build_history_index(entry["sheets"].get("Results_Data", []))
+    return entry["history_index"]
+
+def _open_local_workbook(path: str):
+    """Open the local workbook for editing, or start an empty one."""
+    if os.path.exists(path):
+        return openpyxl.load_workbook(path)
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    return workbook
+
+def _save_local_workbook(workbook, path: str):
+    """Write the workbook atomically so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    workbook.save(tmp_path)
+    os.replace(tmp_path, path)
+
+def save_reports_to_local_workbook(path: str, reports_rows: list, report_type: str,
+                                   stats: dict = None) -> bool:
+    """Save reports' rows to the local workbook with the same upsert rules as Excel Online.
+    
+    The sheet is read, planned and written under one lock, so saves from
+    other sessions can't interleave. stats receives rows_written.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("requests", 0)
     
-    client = anthropic.Anthropic(api_key=api_key)
+    sheet_name, headers = get_sheet_schema(report_type)
+    store = _local_workbook_store()
     
-    if report_type == "Results Report":
-        extraction_prompt = """Extract metadata from this assessment report. Return ONLY valid JSON.
+    try:
+        with store["lock"]:
+            workbook = _open_local_workbook(path)
+            if sheet_name in workbook.sheetnames:
+                worksheet = workbook[sheet_name]
+            else:
+                worksheet = workbook.create_sheet(sheet_name)
+                worksheet.append(headers)
+            
+            existing_data = _records_from_values(_worksheet_values(worksheet))
+            writes = plan_batch_sheet_writes(existing_data, reports_rows, headers)
+            for row_num, values in writes.items():
+                for column, value in enumerate(values, start=1):
+                    # cell(value=None) leaves the old value, so clear by assignment
+                    worksheet.cell(row=row_num, column=column).value = value if value != "" else None
+            
+            _save_local_workbook(workbook, path)
+            store["entries"].pop(path, None)
+        
+        stats["rows_written"] = stats.get("rows_written", 0) + len(writes)
+        return True
+        
+    except Exception as e:
+        st.error(f"Error saving to local workbook: {str(e)}")
+        return False
+
+def _local_sync_state_path(path: str) -> str:
+    return f"{path}.sync.json"
+
+def _load_local_sync_state(path: str) -> dict:
+    """Load the hashes of the unit/year groups last pushed to Excel Online."""
+    try:
+        with open(_local_sync_state_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"synced_at": None, "groups": {}}
+
+def _save_local_sync_state(path: str, state: dict):
+    sync_path = _local_sync_state_path(path)
+    tmp_path = f"{sync_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, sync_path)
+
+def get_local_sheet_groups(path: str, sheet_name: str, headers: list) -> dict:
+    """Group a local sheet's non-blank rows by unit|year, with a content hash per group.
+    
+    Returns {unit|year: {"rows", "hash"}}, computed once per workbook snapshot.
+    """
+    entry = _load_local_workbook_entry(path)
+    groups_by_sheet = entry.setdefault("sync_groups", {})
+    if sheet_name not in groups_by_sheet:
+        groups = {}
+        for record in entry["sheets"].get(sheet_name, []):
+            values = [str(record.get(h, "")) for h in headers]
+            if not any(values):
+                continue
+            key = f"{record.get('unit_id', '')}|{record.get('academic_year', '')}"
+            group = groups.setdefault(key, {"rows": [], "values": []})
+            group["rows"].append(record)
+            group["values"].append(values)
+        for group in groups.values():
+            group["hash"] = cache_key(json.dumps(group.pop("values")))
+        groups_by_sheet[sheet_name] = groups
+    return groups_by_sheet[sheet_name]
+
+def local_workbook_sync_status(path: str) -> dict:
+    """Summarize the local workbook: rows per sheet and unit/year groups not yet synced."""
+    state = _load_local_sync_state(path)
+    status = {"rows": 0, "pending": 0, "synced_at": state.get("synced_at")}
+    for report_type in REPORT_TYPES:
+        sheet_name, headers = get_sheet_schema(report_type)
+        synced = state["groups"].get(sheet_name, {})
+        groups = get_local_sheet_groups(path, sheet_name, headers)
+        status["rows"] += sum(len(group["rows"]) for group in groups.values())
+        status["pending"] += sum(1 for key, group in groups.items() if synced.get(key) != group["hash"])
+    store = _local_workbook_store()
+    with store["lock"]:
+        status["running"] = store["sync"].get(path, {}).get("running", False)
+    return status
+
+def sync_local_workbook_to_excel(path: str, access_token: str, drive_id: str, item_id: str,
+                                 stats: dict = None) -> dict:
+    """Push the unit/year groups changed since the last sync to Excel Online.
+    
+    Each changed group is saved like one report, so its Excel Online rows are
+    upserted and orphaned outcomes cleared; rows that only exist in Excel
+    Online are left alone. Only groups whose writes all succeeded are marked
+    synced. Returns {"groups": pushed, "failed": [sheets with unsynced groups]}.
+    """
+    if stats is None:
+        stats = {}
+    stats.setdefault("requests", 0)
+    result = {"groups": 0, "failed": []}
+    
+    with _local_workbook_store()["sync_lock"]:
+        state = _load_local_sync_state(path)
+        for report_type in REPORT_TYPES:
+            sheet_name, headers = get_sheet_schema(report_type)
+            synced = state["groups"].setdefault(sheet_name, {})
+            changed = {
+                key: group for key, group in get_local_sheet_groups(path, sheet_name, headers).items()
+                if synced.get(key) != group["hash"]
+            }
+            if not changed:
+                continue
+            
+            reports_rows = [group["rows"] for group in changed.values()]
+            saved = save_reports_to_excel_online(access_token, drive_id, item_id, reports_rows, report_type, stats=stats)
+            # Groups whose rows didn't all reach Excel Online stay pending for the next sync
+            for (key, group), ok in zip(changed.items(), saved):
+                if ok:
+                    synced[key] = group["hash"]
+                    result["groups"] += 1
+            if not all(saved):
+                result["failed"].append(sheet_name)
+        
+        if not result["failed"]:
+            state["synced_at"] = datetime.now().isoformat(timespec="seconds")
+        _save_local_sync_state(path, state)
+    return result
+
+def load_local_workbook_from_excel(path: str, access_token: str, drive_id: str, item_id: str,
+                                   stats: dict = None) -> bool:
+    """Replace the local workbook's sheets with the current Excel Online data.
+    
+    Only the schema columns are kept. Everything loaded counts as synced, so
+    later syncs push just the changes made locally afterwards.
+    """
+    sheets = []
+    for report_type in REPORT_TYPES:
+        sheet_name, headers = get_sheet_schema(report_type)
+        records = load_sheet_for_save(access_token, drive_id, item_id, sheet_name, headers, stats=stats)
+        if records is None:
+            return False
+        sheets.append((sheet_name, headers, records))
+    
+    store = _local_workbook_store()
+    with store["sync_lock"]:
+        try:
+            with store["lock"]:
+                workbook = _open_local_workbook(path)
+                for sheet_name, headers, records in sheets:
+                    if sheet_name in workbook.sheetnames:
+                        workbook.remove(workbook[sheet_name])
+                    worksheet = workbook.create_sheet(sheet_name)
+                    worksheet.append(headers)
+                    for record in records:
+                        values = [record.get(h, "") for h in headers]
+                        if any(value != "" for value in values):
+                            worksheet.append([value if value != "" else None for value in values])
+                _save_local_workbook(workbook, path)
+                store["entries"].pop(path, None)
+        except Exception as e:
+            st.error(f"Error writing local workbook: {str(e)}")
+            return False
+        
+        state = {"synced_at": datetime.now().isoformat(timespec="seconds"), "groups": {}}
+        for sheet_name, headers, _ in sheets:
+            groups = get_local_sheet_groups(path, sheet_name, headers)
+            state["groups"][sheet_name] = {key: group["hash"] for key, group in groups.items()}
+        _save_local_sync_state(path, state)
+    return True
+
+def _run_local_workbook_sync(path: str, access_token: str, drive_id: str, item_id: str):
+    store = _local_workbook_store()
+    stats = {}
+    try:
+        result = sync_local_workbook_to_excel(path, access_token, drive_id, item_id, stats=stats)
+    except Exception as e:
+        result = {"groups": 0, "failed": [], "error": str(e)}
+    result["requests"] = stats.get("requests", 0)
+    with store["lock"]:
+        store["sync"][path] = {"running": False, "finished_at": time.monotonic(), "result": result}
+
+def start_local_workbook_sync(path: str, access_token: str, drive_id: str, item_id: str,
+                              min_interval: float = 0) -> bool:
+    """Sync on a background thread, unless one is running or the last ended within min_interval.
+    
+    Returns True if a sync was started.
+    """
+    store = _local_workbook_store()
+    with store["lock"]:
+        last = store["sync"].get(path, {})
+        if last.get("running"):
+            return False
+        if last and time.monotonic() - last["finished_at"] < min_interval:
+            return False
+        store["sync"][path] = {**last, "running": True}
+    
+    threading.Thread(
+        target=_run_local_workbook_sync,
+        args=(path, access_token, drive_id, item_id),
+        name="local-workbook-sync",
+        daemon=True
+    ).start()
+    return True
+
+def last_local_workbook_sync(path: str) -> dict:
+    """Return the most recent background sync result for a workbook, or None."""
+    store = _local_workbook_store()
+    with store["lock"]:
+        return store["sync"].get(path, {}).get("result")
+
+# ============================================================================
+# STORAGE BACKENDS
+# ============================================================================
+
+def excel_storage(access_token: str, drive_id: str, item_id: str) -> dict:
+    """Describe the Excel Online workbook as a metadata store."""
+    return {"backend": "excel", "access_token": access_token, "drive_id": drive_id, "item_id": item_id}
+
+def local_storage(path: str = None) -> dict:
+    """Describe a local workbook as a metadata store."""
+    return {"backend": "local", "path": path or LOCAL_WORKBOOK_PATH}
+
+def storage_label(storage: dict = None) -> str:
+    """Name of a storage backend, or of the configured one when storage is None."""
+    backend = storage["backend"] if storage else STORAGE_BACKEND
+    return "Local Workbook" if backend == "local" else "Excel Online"
+
+def storage_unavailable_message() -> str:
+    """Explain why the configured storage backend can't be used."""
+    if STORAGE_BACKEND not in ("excel", "local"):
+        return f'Unknown STORAGE_BACKEND "{STORAGE_BACKEND}"; use "excel" or "local".'
+    if STORAGE_BACKEND == "local":
+        return "Local Workbook storage needs openpyxl, which is not installed."
+    return "Excel Online not connected."
+
+def get_storage_records(storage: dict, sheet_name: str, stats: dict = None) -> list:
+    """Get all records from one of the metadata sheets."""
+    if storage["backend"] == "local":
+        return get_local_worksheet_data(storage["path"], sheet_name)
+    return get_worksheet_data(storage["access_token"], storage["drive_id"], storage["item_id"],
+                              sheet_name, stats=stats)
+
+def get_storage_snapshot(storage: dict, sheet_name: str, stats: dict = None):
+    """Return (records, version) for a sheet, or None if it couldn't be read.
+    
+    version changes whenever the sheet may have changed (the workbook's cTag,
+    or the local file's timestamp) and is None when that isn't known.
+    """
+    if storage["backend"] == "local":
+        entry = _load_local_workbook_entry(storage["path"])
+        return entry["sheets"].get(sheet_name, []), f"local:{storage['path']}:{entry['stamp']}"
+    
+    entry = _load_worksheet_entry(storage["access_token"], storage["drive_id"], storage["item_id"],
+                                  sheet_name, stats)
+    if entry is None:
+        return None
+    version = f"excel:{storage['drive_id']}/{storage['item_id']}:{entry['version']}" if entry["version"] else None
+    return entry["records"], version
+
+def save_metadata(storage: dict, metadata_rows: list, report_type: str, stats: dict = None) -> bool:
+    """Save one report's rows, upserting on unit|year|outcome."""
+    if storage["backend"] == "local":
+        return save_reports_to_local_workbook(storage["path"], [metadata_rows], report_type, stats=stats)
+    return save_metadata_to_excel_online(storage["access_token"], storage["drive_id"], storage["item_id"],
+                                         metadata_rows, report_type, stats=stats)
+
+def save_reports(storage: dict, reports_rows: list, report_type: str, stats: dict = None) -> list:
+    """Save many reports' rows as if each had been saved in turn.
+    
+    Returns one flag per report, True if all of its rows were written.
+    """
+    if storage["backend"] == "local":
+        # The local workbook is replaced in one step, so reports succeed or fail together
+        saved = save_reports_to_local_workbook(storage["path"], reports_rows, report_type, stats=stats)
+        return [saved] * len(reports_rows)
+    return save_reports_to_excel_online(storage["access_token"], storage["drive_id"], storage["item_id"],
+                                        reports_rows, report_type, stats=stats)
+
+def get_historical_data(storage: dict, unit_id: str, outcome_id: str = None) -> list:
+    """Retrieve historical data for stagnation detection and context.
+    
+    With an outcome_id, records come back sorted by academic year.
+    """
+    try:
+        if storage["backend"] == "local":
+            index = get_local_history_index(storage["path"])
+        else:
+            index = get_history_index(storage["access_token"], storage["drive_id"], storage["item_id"])
+        
+        if outcome_id:
+            return list(index["by_unit_outcome"].get((unit_id, outcome_id), []))
+        return list(index["by_unit"].get(unit_id, []))
+        
+    except Exception as e:
+        return []
+
+def get_previous_improvements(storage: dict, unit_id: str) -> list:
+    """Get proposed improvements from previous Results reports."""
+    historical = get_historical_data(storage, unit_id)
+    
+    # Sort by academic year descending
+    historical.sort(key=lambda x: str(x.get("academic_year", "")), reverse=True)
+    
+    improvements = []
+    for record in historical:
+        if record.get("proposed_improvement"):
+            improvements.append({
+                "academic_year": record.get("academic_year"),
+                "outcome_id": record.get("outcome_id"),
+                "proposed_improvement": record.get("proposed_improvement")
+            })
+    
+    return improvements
+
+# ============================================================================
+# STAGNATION DETECTION
+# ============================================================================
+
+def check_stagnation_all(storage: dict, unit_id: str, outcomes: list) -> list:
+    """Check every outcome of a report for stagnation from one sheet read.
+    
+    An outcome is stagnant when it has at least two years of history and
+    was Fully Achieved in each of its last three (or two) years. Returns one
+    result per outcome, in report order, with its outcome_id attached.
+    """
+    outcome_ids = [outcome.get("outcome_id", "") for outcome in outcomes]
+    summary = pd.DataFrame()
+    
+    historical = get_historical_data(storage, unit_id)
+    if historical:
+        history = pd.DataFrame(historical)
+        for column in ["outcome_id", "academic_year", "achievement_level", "assessment_method"]:
+            if column not in history:
+                history[column] = ""
+        if "assessment_method_normalized" not in history:
+            history["assessment_method_normalized"] = history["assessment_method"]
+        history = history.fillna("")
+        
+        history = history[history["outcome_id"].isin(outcome_ids)]
+        # Years may load as numbers or text, so compare them as text
+        history = history.sort_values("academic_year", key=lambda years: years.astype(str), kind="stable")
+        history["achieved"] = history["achievement_level"] == "Fully Achieved"
+        
+        counts = history.groupby("outcome_id").size()
+        recent = history.groupby("outcome_id", sort=False).tail(3)
+        summary = recent.groupby("outcome_id", sort=False).agg(
+            all_achieved=("achieved", "all"),
+            years=("academic_year", list),
+            methods=("assessment_method_normalized", list)
+        )
+        summary["history"] = counts
+    
+    results = []
+    for outcome_id in outcome_ids:
+        if outcome_id not in summary.index or summary.at[outcome_id, "history"] < 2:
+            result = {"stagnant": False, "reason": "insufficient_history"}
+        elif not summary.at[outcome_id, "all_achieved"]:
+            result = {"stagnant": False, "reason": "not_all_achieved"}
+        else:
+            years = summary.at[outcome_id, "years"]
+            result = {
+                "stagnant": True,
+                "years_achieved": len(years),
+                "years": years,
+                "methods": summary.at[outcome_id, "methods"],
+                "needs_ai_verification": True
+            }
+        result["outcome_id"] = outcome_id
+        results.append(result)
+    
+    return results
+
+# ============================================================================
+# DISK CACHE
+# ============================================================================
+
+def cache_key(*parts) -> str:
+    """Build a content-addressed cache key from the given parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+def _disk_cache_path(namespace: str, key: str) -> str:
+    return os.path.join(CACHE_DIR, namespace, f"{key}.json")
+
+def disk_cache_get(namespace: str, key: str):
+    """Return a cached JSON value, or None on a miss."""
+    path = _disk_cache_path(namespace, key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            value = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    # Touch the entry so eviction treats it as recently used
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return value
+
+def disk_cache_put(namespace: str, key: str, value, max_bytes: int):
+    """Store a JSON value, evicting least recently used entries over max_bytes."""
+    path = _disk_cache_path(namespace, key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+        _evict_disk_cache(namespace, max_bytes)
+    except (OSError, TypeError, ValueError):
+        # Caching is best effort; never fail the caller
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _disk_cache_entries(namespace: str) -> list:
+    """List (mtime, size, path) for every entry in a namespace."""
+    entries = []
+    try:
+        with os.scandir(os.path.join(CACHE_DIR, namespace)) as it:
+            for entry in it:
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    except OSError:
+                        pass
+    except OSError:
+        pass
+    return entries
+
+def _evict_disk_cache(namespace: str, max_bytes: int):
+    entries = _disk_cache_entries(namespace)
+    total = sum(size for _, size, _ in entries)
+    if total <= max_bytes:
+        return
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total -= size
+        if total <= max_bytes:
+            break
+
+def disk_cache_stats(namespace: str) -> dict:
+    """Return entry count and total size for a namespace."""
+    entries = _disk_cache_entries(namespace)
+    return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+def disk_cache_clear(namespace: str) -> int:
+    """Delete every entry in a namespace and return how many were removed."""
+    removed = 0
+    for _, _, path in _disk_cache_entries(namespace):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+@st.cache_resource
+def _cache_counters() -> dict:
+    """Process-wide cache hit/miss counters, shared across sessions and reruns."""
+    return {"lock": threading.Lock(), "namespaces": {}}
+
+def record_cache_event(namespace: str, hit: bool, saved_cost: float = 0.0):
+    """Count a cache hit or miss, and the API cost a hit avoided."""
+    counters = _cache_counters()
+    with counters["lock"]:
+        stats = counters["namespaces"].setdefault(
+            namespace, {"hits": 0, "misses": 0, "saved_cost": 0.0}
+        )
+        if hit:
+            stats["hits"] += 1
+            stats["saved_cost"] += saved_cost
+        else:
+            stats["misses"] += 1
+
+def get_cache_counters(namespace: str) -> dict:
+    """Return hit/miss counts and saved cost for a namespace."""
+    counters = _cache_counters()
+    with counters["lock"]:
+        stats = counters["namespaces"].get(namespace, {"hits": 0, "misses": 0, "saved_cost": 0.0})
+        return dict(stats)
+
+# ============================================================================
+# CLAUDE API
+# ============================================================================
+
+# Stands in for {report_text} while rendering the static prompt prefix
+REPORT_TEXT_PLACEHOLDER = "\x00REPORT_TEXT\x00"
+# Heading put before the report text when a prompt template has none of its own
+REPORT_HEADING = "## Report to Analyze:"
+
+def claude_request_params(system_prompt: str, user_content: str, max_tokens: int = 4000) -> dict:
+    """Build Messages API parameters with the static prompt marked cacheable."""
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": max_tokens,
+        "system": [{
+            "type": "text",
+            "text": system_prompt,
+            "cache_control": {"type": "ephemeral"}
+        }],
+        "messages": [{"role": "user", "content": user_content}]
+    }
+
+def summarize_usage(usage) -> tuple:
+    """Return (token counts, estimated cost in USD) for a response's usage."""
+    input_tokens = usage.input_tokens
+    output_tokens = usage.output_tokens
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    cache_read_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+    
+    # Cache writes bill at 1.25x the input rate and cache reads at 0.1x
+    estimated_cost = (
+        (input_tokens * 0.003 / 1000)
+        + (cache_write_tokens * 0.00375 / 1000)
+        + (cache_read_tokens * 0.0003 / 1000)
+        + (output_tokens * 0.015 / 1000)
+    )
+    tokens = {
+        "input": input_tokens,
+        "output": output_tokens,
+        "cache_write": cache_write_tokens,
+        "cache_read": cache_read_tokens
+    }
+    return tokens, estimated_cost
+
+def stream_claude_message(client, params: dict, on_text=None) -> tuple:
+    """Stream a message, passing the text so far to on_text as it arrives.
+    
+    Returns (final message, timing) where timing records seconds to the first
+    token and in total.
+    """
+    start = time.monotonic()
+    first_token = None
+    last_update = 0.0
+    chunks = []
+    
+    with client.messages.stream(**params) as stream:
+        for text in stream.text_stream:
+            now = time.monotonic()
+            if first_token is None:
+                first_token = now - start
+            chunks.append(text)
+            # Throttle UI updates; re-rendering on every token is wasteful
+            if on_text and now - last_update >= 0.1:
+                on_text("".join(chunks))
+                last_update = now
+        message = stream.get_final_message()
+    
+    if on_text:
+        on_text("".join(chunks))
+    
+    timing = {"first_token": first_token, "total": time.monotonic() - start}
+    return message, timing
+
+# ============================================================================
+# METADATA EXTRACTION
+# ============================================================================
+
+# Bump when the extraction prompts change so cached extractions are not reused
+EXTRACTION_PROMPT_VERSION = "1"
+
+RESULTS_EXTRACTION_PROMPT = """Extract metadata from this assessment report. Return ONLY valid JSON.
 
 {
   "unit_type": "Academic or Administrative (check header of report)",
@@ -1463,8 +2985,8 @@ def extract_metadata_with_ai(report_text: str, report_type: str, api_key: str) -
 
 Report to extract from:
 """
-    elif report_type == "Improvement Report":
-        extraction_prompt = """Extract metadata from this improvement report. Return ONLY valid JSON.
+
+IMPROVEMENT_EXTRACTION_PROMPT = """Extract metadata from this improvement report. Return ONLY valid JSON.
 
 {
   "unit_type": "Academic or Administrative",
@@ -1482,8 +3004,8 @@ Report to extract from:
 
 Report to extract from:
 """
-    else:  # Next Cycle Plan
-        extraction_prompt = """Extract metadata from this assessment plan. Return ONLY valid JSON.
+
+PLAN_EXTRACTION_PROMPT = """Extract metadata from this assessment plan. Return ONLY valid JSON.
 
 {
   "unit_type": "Academic or Administrative",
@@ -1508,50 +3030,104 @@ Report to extract from:
 
 Report to extract from:
 """
+
+def get_extraction_prompt(report_type: str) -> str:
+    """Return the metadata extraction prompt for a report type."""
+    if report_type == "Results Report":
+        return RESULTS_EXTRACTION_PROMPT
+    elif report_type == "Improvement Report":
+        return IMPROVEMENT_EXTRACTION_PROMPT
+    else:  # Next Cycle Plan
+        return PLAN_EXTRACTION_PROMPT
+
+def extract_metadata_with_ai(report_text: str, report_type: str, api_key: str, client=None,
+                             use_cache: bool = True) -> dict:
+    """Use Claude to extract structured metadata from report."""
+    
+    # Identical text, type, prompt version and model always map to the same entry
+    key = cache_key(report_text, report_type, EXTRACTION_PROMPT_VERSION, CLAUDE_MODEL)
+    if use_cache:
+        cached = disk_cache_get("extraction", key)
+        if cached is not None:
+            record_cache_event("extraction", hit=True)
+            return cached
+    
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
+    
+    extraction_prompt = get_extraction_prompt(report_type)
     
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4000,
-            messages=[{
-                "role": "user",
-                "content": extraction_prompt + report_text
-            }]
-        )
+        response = client.messages.create(**claude_request_params(extraction_prompt, report_text))
         
-        response_text = response.content[0].text
-        
-        # Parse JSON from response
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            return json.loads(json_match.group())
-        else:
-            return {"error": "Could not parse JSON from response"}
+        metadata = parse_metadata_response(response.content[0].text)
+        if "error" not in metadata:
+            record_cache_event("extraction", hit=False)
+            disk_cache_put("extraction", key, metadata, EXTRACTION_CACHE_MAX_BYTES)
+        return metadata
             
     except Exception as e:
         return {"error": str(e)}
 
+def parse_metadata_response(response_text: str) -> dict:
+    """Parse the metadata JSON out of an extraction response."""
+    json_match = re.search(r'\{[\s\S]*\}', response_text)
+    if json_match:
+        return json.loads(json_match.group())
+    else:
+        return {"error": "Could not parse JSON from response"}
+
 # ============================================================================
 # AI ANALYSIS
 # ============================================================================
 
-def analyze_report(report_text: str, report_type: str, api_key: str,
-                   stagnation_info: dict = None, previous_improvements: list = None) -> dict:
-    """Analyze report using Claude with appropriate prompt."""
+def snapshot_prompt_settings() -> dict:
+    """Copy the session's prompt settings so they can be used off the script thread."""
+    defaults = {
+        "custom_rubric_text": "",
+        "good_outcome_example": "",
+        "good_criteria_example": "",
+        "good_improvement_example": "",
+        "good_action_example": "",
+        "results_prompt": DEFAULT_RESULTS_ANALYSIS_PROMPT,
+        "improvement_prompt": DEFAULT_IMPROVEMENT_ANALYSIS_PROMPT,
+        "plan_prompt": DEFAULT_PLAN_ANALYSIS_PROMPT,
+        "rubric_guidance": DEFAULT_RUBRIC_GUIDANCE,
+        "tone_instructions": DEFAULT_TONE_INSTRUCTIONS
+    }
+    return {key: st.session_state.get(key, default) for key, default in defaults.items()}
+
+def build_analysis_prompt(report_text: str, report_type: str,
+                          stagnation_info=None, previous_improvements: list = None,
+                          settings: dict = None) -> tuple:
+    """Render the analysis prompt as (static system prefix, per-report user content).
     
-    client = anthropic.Anthropic(api_key=api_key)
+    Prompt settings come from session state unless a snapshot is passed in.
+    """
+    if settings is None:
+        settings = snapshot_prompt_settings()
     
     # Build context sections
+    # Accept a single stagnation result or the list from check_stagnation_all
+    if isinstance(stagnation_info, dict):
+        stagnation_info = [stagnation_info]
+    stagnant = [info for info in (stagnation_info or []) if info.get("stagnant")]
+    
     stagnation_context = ""
-    if stagnation_info and stagnation_info.get("stagnant"):
+    if stagnant:
+        outcome_details = "\n".join([
+            f"""- {f"Outcome {info['outcome_id']}" if info.get('outcome_id') else "This outcome"}: Fully Achieved for {info['years_achieved']} consecutive years
+  Years: {', '.join(str(year) for year in info['years'])}
+  Methods used: {'; '.join(str(method) for method in info['methods'])}"""
+            for info in stagnant
+        ])
         stagnation_context = f"""
 ## STAGNATION CHECK REQUIRED
 
-Historical data shows this outcome may have been Fully Achieved for {stagnation_info['years_achieved']} consecutive years:
-Years: {', '.join(stagnation_info['years'])}
-Methods used: {'; '.join(stagnation_info['methods'])}
+Historical data shows the following outcomes may have been Fully Achieved for several consecutive years:
+{outcome_details}
 
-Please evaluate:
+For each outcome, please evaluate:
 1. Are these methodologies functionally the same? (Same test/exam in same course counts as same, even if wording differs. Different test OR different course = different methodology)
 2. If methodology is unchanged AND outcome achieved for 3+ years, include a gentle note suggesting the unit consider evolving their assessment (raising benchmark, refining outcome, changing methodology, or replacing with more challenging outcome).
 
@@ -1574,28 +3150,28 @@ When analyzing this improvement report, consider whether the actions taken align
 """
     
     custom_rubric = ""
-    if st.session_state.get("custom_rubric_text"):
+    if settings.get("custom_rubric_text"):
         custom_rubric = f"""
 ## ADDITIONAL EVALUATION CRITERIA (Custom Rubric)
 
-{st.session_state['custom_rubric_text']}
+{settings['custom_rubric_text']}
 """
     
     # Build good examples section
     good_examples = ""
     examples_list = []
     
-    if st.session_state.get("good_outcome_example"):
-        examples_list.append(f"**Good Outcome Statement:**\n{st.session_state['good_outcome_example']}")
+    if settings.get("good_outcome_example"):
+        examples_list.append(f"**Good Outcome Statement:**\n{settings['good_outcome_example']}")
     
-    if st.session_state.get("good_criteria_example"):
-        examples_list.append(f"**Good Criteria for Success:**\n{st.session_state['good_criteria_example']}")
+    if settings.get("good_criteria_example"):
+        examples_list.append(f"**Good Criteria for Success:**\n{settings['good_criteria_example']}")
     
-    if st.session_state.get("good_improvement_example"):
-        examples_list.append(f"**Good Proposed Improvement:**\n{st.session_state['good_improvement_example']}")
+    if settings.get("good_improvement_example"):
+        examples_list.append(f"**Good Proposed Improvement:**\n{settings['good_improvement_example']}")
     
-    if st.session_state.get("good_action_example"):
-        examples_list.append(f"**Good Action Steps:**\n{st.session_state['good_action_example']}")
+    if settings.get("good_action_example"):
+        examples_list.append(f"**Good Action Steps:**\n{settings['good_action_example']}")
     
     if examples_list:
         good_examples = "\n\n## EXAMPLES OF QUALITY WORK\nUse these as reference for what good looks like. Recognize similar quality in reports you analyze:\n\n" + "\n\n".join(examples_list)
@@ -1605,45 +3181,400 @@ When analyzing this improvement report, consider whether the actions taken align
     
     # Select appropriate prompt template
     if report_type == "Results Report":
-        prompt_template = st.session_state.get("results_prompt", DEFAULT_RESULTS_ANALYSIS_PROMPT)
+        prompt_template = settings.get("results_prompt", DEFAULT_RESULTS_ANALYSIS_PROMPT)
     elif report_type == "Improvement Report":
-        prompt_template = st.session_state.get("improvement_prompt", DEFAULT_IMPROVEMENT_ANALYSIS_PROMPT)
+        prompt_template = settings.get("improvement_prompt", DEFAULT_IMPROVEMENT_ANALYSIS_PROMPT)
     else:
-        prompt_template = st.session_state.get("plan_prompt", DEFAULT_PLAN_ANALYSIS_PROMPT)
-    
-    # Build final prompt
-    prompt = prompt_template.format(
-        rubric_guidance=st.session_state.get("rubric_guidance", DEFAULT_RUBRIC_GUIDANCE),
-        tone_instructions=st.session_state.get("tone_instructions", DEFAULT_TONE_INSTRUCTIONS),
-        stagnation_context=stagnation_context,
-        previous_context=previous_context,
+        prompt_template = settings.get("plan_prompt", DEFAULT_PLAN_ANALYSIS_PROMPT)
+    
+    # Render the static parts once with a placeholder where the report goes.
+    # Everything before the report heading is identical across reports and
+    # becomes the cacheable system prefix. The per-report history context
+    # goes in its own labelled block ahead of the report, where the checks
+    # section used to carry it, never after the output format.
+    rendered = prompt_template.format(
+        rubric_guidance=settings.get("rubric_guidance", DEFAULT_RUBRIC_GUIDANCE),
+        tone_instructions=settings.get("tone_instructions", DEFAULT_TONE_INSTRUCTIONS),
+        stagnation_context="",
+        previous_context="",
         custom_rubric=custom_rubric,
-        report_text=report_text
+        report_text=REPORT_TEXT_PLACEHOLDER
     )
+    system_prompt, _, template_tail = rendered.partition(REPORT_TEXT_PLACEHOLDER)
+    
+    # Move the template's own heading for the report ("## Report to Analyze:",
+    # "## Plan to Analyze:", ...) from the end of the prefix to after the context
+    prefix, _, last_line = system_prompt.rstrip().rpartition("\n")
+    if last_line.lstrip().startswith("#"):
+        system_prompt, report_heading = prefix, last_line.strip()
+    else:
+        report_heading = REPORT_HEADING
+    
+    user_content = ""
+    report_context = (stagnation_context + previous_context).strip()
+    if report_context:
+        user_content = (
+            "## Context From Previous Reports\n"
+            "This comes from the unit's saved assessment history, not from the report. "
+            "Apply it while completing the checks above.\n\n"
+            f"{report_context}\n\n"
+        )
+    user_content += (f"{report_heading}\n\n{report_text}{template_tail}").rstrip()
+    
+    return system_prompt.rstrip() + "\n", user_content
+
+def analyze_report(report_text: str, report_type: str, api_key: str,
+                   stagnation_info=None, previous_improvements: list = None,
+                   client=None, use_cache: bool = True, on_text=None,
+                   settings: dict = None) -> dict:
+    """Analyze report using Claude with appropriate prompt, streaming text to on_text."""
+    
+    system_prompt, user_content = build_analysis_prompt(
+        report_text, report_type, stagnation_info, previous_improvements, settings
+    )
+    
+    # The fingerprint covers every template, rubric and context edit, so any
+    # change in the admin panel naturally misses the cache
+    key = cache_key(system_prompt, user_content, CLAUDE_MODEL)
+    if use_cache:
+        cached = disk_cache_get("analysis", key)
+        if cached is not None:
+            record_cache_event("analysis", hit=True, saved_cost=cached.get("cost_usd", 0.0))
+            cached["saved_cost"] = cached.get("cost", "$0.0000")
+            cached["cost"] = "$0.0000"
+            cached["cached"] = True
+            return cached
+    
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
     
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=4000,
-            messages=[{"role": "user", "content": prompt}]
+        response, timing = stream_claude_message(
+            client, claude_request_params(system_prompt, user_content), on_text
         )
         
         analysis_text = response.content[0].text
         
         # Calculate costs
-        input_tokens = response.usage.input_tokens
-        output_tokens = response.usage.output_tokens
-        estimated_cost = (input_tokens * 0.003 / 1000) + (output_tokens * 0.015 / 1000)
+        tokens, estimated_cost = summarize_usage(response.usage)
         
-        return {
+        results = {
             "analysis": analysis_text,
-            "tokens": {"input": input_tokens, "output": output_tokens},
-            "cost": f"${estimated_cost:.4f}"
+            "tokens": tokens,
+            "cost": f"${estimated_cost:.4f}",
+            "cost_usd": estimated_cost,
+            "timing": timing
         }
+        record_cache_event("analysis", hit=False)
+        disk_cache_put("analysis", key, results, ANALYSIS_CACHE_MAX_BYTES)
+        return results
         
     except Exception as e:
         return {"error": str(e)}
 
+# ============================================================================
+# SINGLE-PASS EXTRACTION + ANALYSIS
+# ============================================================================
+
+COMBINED_METADATA_START = "<<<METADATA_JSON>>>"
+COMBINED_METADATA_END = "<<<END_METADATA_JSON>>>"
+
+COMBINED_OUTPUT_INSTRUCTIONS = """
+
+## ADDITIONAL OUTPUT: STRUCTURED METADATA
+
+After your complete analysis above, also extract metadata from the report. Output it as valid JSON between the two marker lines below, using exactly this structure. Write nothing after the closing marker.
+
+{start_marker}
+{schema}
+{end_marker}
+"""
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about 4 characters per token for English text)."""
+    return len(text) // 4
+
+def _extraction_schema(report_type: str) -> str:
+    """Return just the JSON schema portion of the extraction prompt."""
+    prompt = get_extraction_prompt(report_type)
+    return prompt[prompt.index("{"):prompt.rindex("}") + 1]
+
+def _parse_json_object(text: str):
+    """Parse the outermost JSON object in text, or return None."""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        value = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+def split_combined_response(response_text: str) -> tuple:
+    """Split a single-pass response into (analysis, metadata).
+    
+    Prefers the explicit markers, then a trailing fenced JSON block, then a
+    trailing bare JSON object. metadata is None if nothing parses.
+    """
+    if COMBINED_METADATA_START in response_text:
+        analysis, _, remainder = response_text.partition(COMBINED_METADATA_START)
+        json_text = remainder.split(COMBINED_METADATA_END)[0]
+        return analysis.strip(), _parse_json_object(json_text)
+    
+    fence_match = re.search(r'```(?:json)?\s*(\{[\s\S]*\})\s*```\s*$', response_text)
+    if fence_match:
+        metadata = _parse_json_object(fence_match.group(1))
+        if metadata is not None:
+            return response_text[:fence_match.start()].strip(), metadata
+    
+    # Try each line that opens a JSON object, earliest first, so the whole
+    # trailing object is captured rather than a nested one
+    for line_match in re.finditer(r'^\{', response_text, re.MULTILINE):
+        metadata = _parse_json_object(response_text[line_match.start():])
+        if metadata is not None:
+            return response_text[:line_match.start()].strip(), metadata
+    
+    return response_text.strip(), None
+
+def analyze_report_combined(report_text: str, report_type: str, api_key: str,
+                            client=None, use_cache: bool = True, on_text=None,
+                            settings: dict = None) -> dict:
+    """Extract metadata and analyze a report with a single Claude call.
+    
+    Falls back to the two-call path for whatever the single call could not
+    provide, noting why in results["fallback"]. Returns
+    {"metadata": ..., "results": ...} or {"error": ...}.
+    """
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
+    
+    instructions = COMBINED_OUTPUT_INSTRUCTIONS.format(
+        start_marker=COMBINED_METADATA_START,
+        schema=_extraction_schema(report_type),
+        end_marker=COMBINED_METADATA_END
+    )
+    system_prompt, user_content = build_analysis_prompt(report_text, report_type, settings=settings)
+    user_content += instructions
+    
+    key = cache_key(system_prompt, user_content, CLAUDE_MODEL)
+    if use_cache:
+        cached = disk_cache_get("analysis", key)
+        if cached is not None:
+            results = cached["results"]
+            record_cache_event("analysis", hit=True, saved_cost=results.get("cost_usd", 0.0))
+            results["saved_cost"] = results.get("cost", "$0.0000")
+            results["cost"] = "$0.0000"
+            results["cached"] = True
+            return {"metadata": cached["metadata"], "results": results}
+    
+    try:
+        # Only the narrative part is shown while streaming
+        show_analysis = (lambda text: on_text(text.split(COMBINED_METADATA_START)[0])) if on_text else None
+        response, timing = stream_claude_message(
+            client, claude_request_params(system_prompt, user_content, max_tokens=8000), show_analysis
+        )
+        response_text = response.content[0].text
+        tokens, estimated_cost = summarize_usage(response.usage)
+    except Exception as e:
+        # Fall back to the two-call path
+        metadata = extract_metadata_with_ai(report_text, report_type, api_key, client=client)
+        results = analyze_report(report_text, report_type, api_key, client=client, on_text=on_text, settings=settings)
+        if "error" in results:
+            return {"error": f"Single-pass call failed ({e}), and so did the separate analysis: {results['error']}"}
+        results["fallback"] = f"Single-pass call failed ({e}), so separate extraction and analysis calls were made"
+        return {"metadata": metadata, "results": results}
+    
+    record_cache_event("analysis", hit=False)
+    analysis_text, metadata = split_combined_response(response_text)
+    
+    # The separate extraction call would have re-sent the prompt and full report
+    saved_input = max(0, estimate_tokens(get_extraction_prompt(report_type) + report_text) - estimate_tokens(instructions))
+    results = {
+        "analysis": analysis_text,
+        "tokens": tokens,
+        "cost": f"${estimated_cost:.4f}",
+        "cost_usd": estimated_cost,
+        "timing": timing,
+        "token_savings": {"input": saved_input, "requests": 1}
+    }
+    
+    if metadata is None:
+        # Splitter found no usable JSON; recover metadata with the extraction call
+        results["token_savings"] = {"input": 0, "requests": 0}
+        results["fallback"] = "Single-pass response had no usable metadata, so a separate extraction call was made"
+        metadata = extract_metadata_with_ai(report_text, report_type, api_key, client=client)
+        return {"metadata": metadata, "results": results}
+    
+    # Seed the extraction cache so a later two-call run reuses this metadata
+    extraction_key = cache_key(report_text, report_type, EXTRACTION_PROMPT_VERSION, CLAUDE_MODEL)
+    disk_cache_put("extraction", extraction_key, metadata, EXTRACTION_CACHE_MAX_BYTES)
+    disk_cache_put("analysis", key, {"metadata": metadata, "results": results}, ANALYSIS_CACHE_MAX_BYTES)
+    
+    return {"metadata": metadata, "results": results}
+
+# ============================================================================
+# BACKGROUND ANALYSIS JOBS
+# ============================================================================
+
+def run_analysis_pipeline(report_text: str, report_type: str, api_key: str, settings: dict,
+                          combined: bool = False, history: dict = None, registry: dict = None,
+                          client=None, on_stage=None, on_text=None) -> dict:
+    """Extract metadata and analyze one report without touching session state.
+    
+    history is the metadata storage (see excel_storage and local_storage),
+    enabling stagnation and previous-improvement context. Returns
+    {"metadata", "results", "errors"}; metadata and results may be None.
+    """
+    on_stage = on_stage or (lambda stage: None)
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
+    outcome = {"metadata": None, "results": None, "errors": []}
+    
+    if combined:
+        on_stage("Analyzing...")
+        combined_result = analyze_report_combined(
+            report_text, report_type, api_key, client=client, on_text=on_text, settings=settings
+        )
+        if "error" in combined_result:
+            outcome["errors"].append(combined_result["error"])
+            return outcome
+        outcome["metadata"] = combined_result["metadata"]
+        if "error" in outcome["metadata"]:
+            outcome["errors"].append(outcome["metadata"]["error"])
+        outcome["results"] = combined_result["results"]
+        return outcome
+    
+    on_stage("Extracting metadata...")
+    metadata = extract_metadata_with_ai(report_text, report_type, api_key, client=client)
+    outcome["metadata"] = metadata
+    if "error" in metadata:
+        outcome["errors"].append(metadata["error"])
+    
+    # Historical context
+    stagnation_info = None
+    previous_improvements = None
+    
+    if history and "error" not in metadata:
+        on_stage("Checking history...")
+        # Extraction doesn't return unit ids, so resolve the unit from the registry
+        unit_id = metadata.get("unit_id")
+        if not unit_id and registry:
+            match = find_matching_unit(
+                metadata.get("unit_name", ""),
+                metadata.get("unit_type", "Academic"),
+                registry
+            )
+            if match["match"]:
+                unit_id = match["match"].get("unit_id", "")
+        
+        if unit_id and report_type == "Results Report":
+            stagnation_info = check_stagnation_all(history, unit_id, metadata.get("outcomes", []))
+        
+        elif unit_id and report_type == "Improvement Report":
+            previous_improvements = get_previous_improvements(history, unit_id)
+    
+    on_stage("Analyzing...")
+    results = analyze_report(
+        report_text,
+        report_type,
+        api_key,
+        stagnation_info,
+        previous_improvements,
+        client=client,
+        on_text=on_text,
+        settings=settings
+    )
+    
+    if "error" in results:
+        outcome["errors"].append(results["error"])
+    else:
+        results["stagnant_outcomes"] = [
+            info["outcome_id"] for info in (stagnation_info or []) if info.get("stagnant")
+        ]
+        outcome["results"] = results
+    return outcome
+
+@st.cache_resource
+def _analysis_jobs() -> dict:
+    """Process-wide worker pool and job store for report analyses."""
+    return {
+        "lock": threading.Lock(),
+        "executor": ThreadPoolExecutor(max_workers=ANALYSIS_JOB_WORKERS, thread_name_prefix="analysis"),
+        "jobs": {}
+    }
+
+def analysis_job_key(file_hash: str, report_type: str) -> tuple:
+    """Key a job by this browser session, the uploaded file's hash and the report type."""
+    session_id = st.session_state.setdefault("job_session_id", uuid.uuid4().hex)
+    return (session_id, file_hash, report_type)
+
+def _run_analysis_job(job: dict, pipeline_args: dict):
+    """Run the pipeline for a job on a worker thread, recording progress on the job."""
+    def on_stage(stage):
+        job["stage"] = stage
+    
+    def on_text(text):
+        job["partial"] = text
+    
+    try:
+        job.update(run_analysis_pipeline(**pipeline_args, on_stage=on_stage, on_text=on_text))
+    except Exception as e:
+        job["errors"] = [str(e)]
+    job["finished_at"] = time.time()
+    job["status"] = "done"
+
+def submit_analysis_job(key: tuple, filename: str, **pipeline_args) -> dict:
+    """Queue an analysis unless one is already running for this key, and return its job."""
+    store = _analysis_jobs()
+    with store["lock"]:
+        # Forget results nobody came back for
+        now = time.time()
+        for old_key, old_job in list(store["jobs"].items()):
+            if old_job["finished_at"] and now - old_job["finished_at"] > ANALYSIS_JOB_RETENTION:
+                del store["jobs"][old_key]
+        
+        job = store["jobs"].get(key)
+        if job and job["status"] == "running":
+            return job
+        job = {
+            "status": "running",
+            "stage": "Queued...",
+            "partial": "",
+            "filename": filename,
+            "metadata": None,
+            "results": None,
+            "errors": [],
+            "submitted_at": now,
+            "finished_at": None
+        }
+        store["jobs"][key] = job
+    
+    store["executor"].submit(_run_analysis_job, job, pipeline_args)
+    return job
+
+def get_analysis_job(key: tuple):
+    """Return the job for a key, or None."""
+    store = _analysis_jobs()
+    with store["lock"]:
+        return store["jobs"].get(key)
+
+def pop_analysis_job(key: tuple):
+    """Remove and return the job for a key once its result has been collected."""
+    store = _analysis_jobs()
+    with store["lock"]:
+        return store["jobs"].pop(key, None)
+
+def analysis_jobs_info() -> dict:
+    """Count running and finished jobs for the admin panel."""
+    store = _analysis_jobs()
+    with store["lock"]:
+        jobs = list(store["jobs"].values())
+    return {
+        "running": sum(1 for job in jobs if job["status"] == "running"),
+        "finished": sum(1 for job in jobs if job["status"] == "done")
+    }
+
 # ============================================================================
 # METADATA PREVIEW AND EDITING UI
 # ============================================================================
@@ -1680,29 +3611,45 @@ def render_metadata_editor(metadata: dict, report_type: str, registry: dict):
             registry
         )
         
-        if match_result["match"]:
-            if match_result["confidence"] == "high":
-                st.success(f"✓ Matched: {match_result['match'].get('canonical_name')}")
-                edited["unit_id"] = match_result["match"].get("unit_id", "")
-                edited["canonical_name"] = match_result["match"].get("canonical_name", "")
-            else:
-                st.warning(f"⚠ Possible match: {match_result['match'].get('canonical_name')}")
-                if st.checkbox("Confirm this match", key="confirm_match"):
-                    edited["unit_id"] = match_result["match"].get("unit_id", "")
-                    edited["canonical_name"] = match_result["match"].get("canonical_name", "")
-                else:
-                    edited["unit_id"] = generate_unit_id(
-                        edited["unit_name"],
-                        edited.get("college_division", ""),
-                        edited["unit_type"]
-                    )
+        if match_result["match"] and match_result["confidence"] == "high":
+            st.success(f"✓ Matched: {match_result['match'].get('canonical_name')}")
+            edited["unit_id"] = match_result["match"].get("unit_id", "")
+            edited["canonical_name"] = match_result["match"].get("canonical_name", "")
         else:
-            st.info("ℹ No existing match found. Will create new registry entry.")
-            edited["unit_id"] = generate_unit_id(
-                edited["unit_name"],
-                edited.get("college_division", ""),
-                edited["unit_type"]
-            )
+            # Offer scored candidates, keeping any rule-based match among them
+            candidates = [
+                c for c in suggest_matching_units(edited["unit_name"], edited["unit_type"], registry)
+                if c["score"] >= UNIT_SUGGESTION_MIN_SCORE
+            ]
+            if match_result["match"] and not any(c["unit"] is match_result["match"] for c in candidates):
+                candidates.insert(0, {"unit": match_result["match"], "score": None})
+            
+            selected = None
+            if candidates:
+                st.warning("⚠ No exact match. Choose the registry unit for this report, or create a new one.")
+                choice = st.selectbox(
+                    "Registry Unit",
+                    [-1] + list(range(len(candidates))),
+                    format_func=lambda i: "➕ Create new registry entry" if i < 0 else (
+                        f"{candidates[i]['unit'].get('canonical_name')} ({candidates[i]['unit'].get('unit_id')})"
+                        + (f" · {candidates[i]['score']:.0%}" if candidates[i]["score"] is not None else "")
+                    ),
+                    key=f"edit_unit_match_{edited['unit_type']}_{edited['unit_name']}"
+                )
+                if choice >= 0:
+                    selected = candidates[choice]["unit"]
+            else:
+                st.info("ℹ No existing match found. Will create new registry entry.")
+            
+            if selected:
+                edited["unit_id"] = selected.get("unit_id", "")
+                edited["canonical_name"] = selected.get("canonical_name", "")
+            else:
+                edited["unit_id"] = generate_unit_id(
+                    edited["unit_name"],
+                    edited.get("college_division", ""),
+                    edited["unit_type"]
+                )
     
     with col2:
         edited["college_division"] = st.text_input(
@@ -1959,12 +3906,714 @@ def prepare_rows_for_sheet(metadata: dict, report_type: str) -> list:
     
     return rows
 
+# ============================================================================
+# BATCH IMPORT STORE
+# ============================================================================
+
+def _batch_store_connection() -> sqlite3.Connection:
+    """Open the batch import database, creating it on first use."""
+    os.makedirs(os.path.dirname(BATCH_IMPORT_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(BATCH_IMPORT_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS batch_files (
+            file_hash TEXT NOT NULL,
+            report_type TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL,
+            metadata TEXT,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (file_hash, report_type)
+        )
+    """)
+    return conn
+
+def _batch_store_row(row: sqlite3.Row) -> dict:
+    record = dict(row)
+    record["metadata"] = json.loads(record["metadata"]) if record["metadata"] else None
+    return record
+
+def file_content_hash(file) -> str:
+    """SHA-256 of an uploaded file's bytes."""
+    return hashlib.sha256(file.getvalue()).hexdigest()
+
+def batch_store_get(file_hashes: list, report_type: str) -> dict:
+    """Return stored records for the given files, keyed by file hash."""
+    if not file_hashes:
+        return {}
+    conn = _batch_store_connection()
+    try:
+        placeholders = ",".join("?" * len(file_hashes))
+        rows = conn.execute(
+            f"SELECT * FROM batch_files WHERE report_type = ? AND file_hash IN ({placeholders})",
+            [report_type, *file_hashes]
+        ).fetchall()
+    finally:
+        conn.close()
+    return {row["file_hash"]: _batch_store_row(row) for row in rows}
+
+def batch_store_record(file_hash: str, report_type: str, filename: str, status: str,
+                       metadata: dict = None, error: str = None):
+    """Record a file's extraction status ("extracted" or "error")."""
+    conn = _batch_store_connection()
+    try:
+        with conn:
+            conn.execute("""
+                INSERT INTO batch_files (file_hash, report_type, filename, status, metadata, error, attempts, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (file_hash, report_type) DO UPDATE SET
+                    filename = excluded.filename,
+                    status = excluded.status,
+                    metadata = COALESCE(excluded.metadata, batch_files.metadata),
+                    error = excluded.error,
+                    attempts = batch_files.attempts + 1,
+                    updated_at = excluded.updated_at
+            """, (
+                file_hash, report_type, filename, status,
+                json.dumps(metadata) if metadata is not None else None,
+                error, datetime.now().isoformat()
+            ))
+    finally:
+        conn.close()
+
+def batch_store_set_status(metadata_list: list, report_type: str, status: str):
+    """Mark extracted files as "saved" to the workbook or "dismissed" by the user."""
+    file_hashes = [m["_file_hash"] for m in metadata_list if m.get("_file_hash")]
+    if not file_hashes:
+        return
+    conn = _batch_store_connection()
+    try:
+        with conn:
+            conn.executemany(
+                "UPDATE batch_files SET status = ?, updated_at = ? WHERE file_hash = ? AND report_type = ?",
+                [(status, datetime.now().isoformat(), file_hash, report_type) for file_hash in file_hashes]
+            )
+    finally:
+        conn.close()
+
+def batch_store_unsaved(report_type: str) -> list:
+    """Return metadata extracted in earlier runs that was never saved."""
+    conn = _batch_store_connection()
+    try:
+        rows = conn.execute(
+            "SELECT * FROM batch_files WHERE report_type = ? AND status = 'extracted' ORDER BY filename",
+            (report_type,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [_batch_store_row(row)["metadata"] for row in rows]
+
+def batch_store_summary() -> dict:
+    """Count stored files by status."""
+    if not os.path.exists(BATCH_IMPORT_DB_PATH):
+        return {}
+    conn = _batch_store_connection()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) FROM batch_files GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {status: count for status, count in rows}
+
+def batch_store_clear() -> int:
+    """Forget all stored batch import records."""
+    conn = _batch_store_connection()
+    try:
+        with conn:
+            return conn.execute("DELETE FROM batch_files").rowcount
+    finally:
+        conn.close()
+
+# ============================================================================
+# ANALYTICS MIRROR
+# ============================================================================
+
+def analytics_table(sheet_name: str) -> str:
+    """Mirror table for a metadata sheet (Results_Data -> results_data)."""
+    return sheet_name.lower()
+
+def _analytics_connection() -> sqlite3.Connection:
+    """Open the analytics mirror database, creating its bookkeeping table on first use."""
+    os.makedirs(os.path.dirname(ANALYTICS_DB_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(ANALYTICS_DB_PATH, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS mirror_sync (
+            sheet_name TEXT PRIMARY KEY,
+            columns TEXT NOT NULL,
+            version TEXT,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            synced_at TEXT NOT NULL
+        )
+    """)
+    return conn
+
+def _create_analytics_table(conn: sqlite3.Connection, sheet_name: str, headers: list):
+    table = analytics_table(sheet_name)
+    columns = ", ".join(f'"{h}" TEXT' for h in headers)
+    conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+    conn.execute(f'CREATE TABLE "{table}" (row_key TEXT PRIMARY KEY, row_hash TEXT NOT NULL, {columns})')
+    for column in ANALYTICS_INDEXED_COLUMNS:
+        if column in headers:
+            conn.execute(f'CREATE INDEX "idx_{table}_{column}" ON "{table}" ("{column}")')
+
+def _analytics_rows(records: list, headers: list) -> dict:
+    """Key a sheet's non-blank rows by unit|year|outcome, with a content hash per row."""
+    rows = {}
+    for record in records:
+        values = [str(record.get(h, "")) for h in headers]
+        if not any(values):
+            continue
+        key = _row_key(record)
+        # Hand-edited sheets may repeat a key; keep every copy
+        suffix = 1
+        while key in rows:
+            suffix += 1
+            key = f"{_row_key(record)}#{suffix}"
+        rows[key] = (cache_key(*values), values)
+    return rows
+
+def sync_analytics_mirror(storage: dict, stats: dict = None) -> dict:
+    """Bring the analytics mirror up to date with the three metadata sheets.
+    
+    Sheets whose storage version matches the last sync are skipped. Otherwise
+    rows are compared by content hash and only added, changed and removed
+    rows are written. Returns {sheet name: {"inserted", "updated", "deleted"}},
+    with "skipped" set for unchanged sheets and "error" for unreadable ones.
+    """
+    summary = {}
+    conn = _analytics_connection()
+    try:
+        for report_type in REPORT_TYPES:
+            sheet_name, headers = get_sheet_schema(report_type)
+            table = analytics_table(sheet_name)
+            sync_row = conn.execute(
+                "SELECT columns, version FROM mirror_sync WHERE sheet_name = ?", (sheet_name,)
+            ).fetchone()
+            
+            snapshot = get_storage_snapshot(storage, sheet_name, stats=stats)
+            if snapshot is None:
+                summary[sheet_name] = {"error": True}
+                continue
+            records, version = snapshot
+            schema_changed = sync_row is None or sync_row[0] != json.dumps(headers)
+            if not schema_changed and version is not None and sync_row[1] == version:
+                summary[sheet_name] = {"skipped": True}
+                continue
+            
+            rows = _analytics_rows(records, headers)
+            counts = {"inserted": 0, "updated": 0, "deleted": 0}
+            with conn:
+                if schema_changed:
+                    _create_analytics_table(conn, sheet_name, headers)
+                mirrored = dict(conn.execute(f'SELECT row_key, row_hash FROM "{table}"').fetchall())
+                
+                stale = [key for key in mirrored if key not in rows]
+                changed = []
+                for key, (row_hash, values) in rows.items():
+                    if mirrored.get(key) != row_hash:
+                        counts["updated" if key in mirrored else "inserted"] += 1
+                        changed.append((key, row_hash, *values))
+                counts["deleted"] = len(stale)
+                
+                conn.executemany(f'DELETE FROM "{table}" WHERE row_key = ?', [(key,) for key in stale])
+                placeholders = ",".join("?" * (len(headers) + 2))
+                conn.executemany(f'INSERT OR REPLACE INTO "{table}" VALUES ({placeholders})', changed)
+                conn.execute("""
+                    INSERT OR REPLACE INTO mirror_sync (sheet_name, columns, version, row_count, synced_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (sheet_name, json.dumps(headers), version, len(rows), datetime.now().isoformat(timespec="seconds")))
+            summary[sheet_name] = counts
+    finally:
+        conn.close()
+    return summary
+
+def analytics_filter_options(sheet_name: str) -> dict:
+    """Distinct values of the indexed columns, for the Explore page filters."""
+    table = analytics_table(sheet_name)
+    options = {}
+    conn = _analytics_connection()
+    try:
+        if conn.execute("SELECT 1 FROM mirror_sync WHERE sheet_name = ?", (sheet_name,)).fetchone() is None:
+            return options
+        columns = {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+        for column in ANALYTICS_INDEXED_COLUMNS:
+            if column in columns:
+                options[column] = [
+                    row[0] for row in conn.execute(
+                        f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" != \'\' ORDER BY 1'
+                    )
+                ]
+    finally:
+        conn.close()
+    return options
+
+def query_analytics_mirror(sheet_name: str, filters: dict) -> pd.DataFrame:
+    """Return mirrored rows matching the filters, newest academic year first.
+    
+    filters may hold value lists for any indexed column, "year_from" and
+    "year_to" bounds, and "search" text matched against unit id and name.
+    """
+    table = analytics_table(sheet_name)
+    clauses = []
+    params = []
+    
+    for column in ANALYTICS_INDEXED_COLUMNS:
+        values = filters.get(column)
+        if values:
+            clauses.append(f'"{column}" IN ({",".join("?" * len(values))})')
+            params.extend(values)
+    if filters.get("year_from"):
+        clauses.append('"academic_year" >= ?')
+        params.append(filters["year_from"])
+    if filters.get("year_to"):
+        clauses.append('"academic_year" <= ?')
+        params.append(filters["year_to"])
+    if filters.get("search"):
+        clauses.append('("unit_id" LIKE ? OR "unit_name" LIKE ?)')
+        params.extend([f"%{filters['search']}%"] * 2)
+    
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    conn = _analytics_connection()
+    try:
+        df = pd.read_sql_query(
+            f'SELECT * FROM "{table}" {where} ORDER BY "academic_year" DESC, "unit_id", "outcome_id"',
+            conn, params=params
+        )
+    finally:
+        conn.close()
+    return df.drop(columns=["row_key", "row_hash"])
+
+def analytics_mirror_summary() -> dict:
+    """Rows and last sync time per mirrored sheet."""
+    if not os.path.exists(ANALYTICS_DB_PATH):
+        return {}
+    conn = _analytics_connection()
+    try:
+        rows = conn.execute("SELECT sheet_name, row_count, synced_at FROM mirror_sync ORDER BY sheet_name").fetchall()
+    finally:
+        conn.close()
+    return {sheet_name: {"rows": row_count, "synced_at": synced_at} for sheet_name, row_count, synced_at in rows}
+
+def clear_analytics_mirror():
+    """Delete the mirror database; the next sync rebuilds it."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(ANALYTICS_DB_PATH + suffix):
+            os.remove(ANALYTICS_DB_PATH + suffix)
+
+# ============================================================================
+# CONCURRENT BATCH EXTRACTION
+# ============================================================================
+
+def make_rate_limiter(requests_per_minute: int):
+    """Return a thread-safe wait() that keeps calls within a per-minute budget."""
+    lock = threading.Lock()
+    window = deque()
+    
+    def wait():
+        if not requests_per_minute or requests_per_minute <= 0:
+            return
+        while True:
+            with lock:
+                now = time.monotonic()
+                # Drop calls that have left the 60-second window
+                while window and now - window[0] >= 60:
+                    window.popleft()
+                if len(window) < requests_per_minute:
+                    window.append(now)
+                    return
+                delay = 60 - (now - window[0])
+            time.sleep(delay)
+    
+    return wait
+
+def _extract_file_metadata(file, report_type: str, api_key: str, rate_limit, client) -> dict:
+    """Extract text and metadata for one uploaded file (runs on a worker thread)."""
+    try:
+        text = process_uploaded_file(file)
+        if not text:
+            return {"filename": file.name, "error": "Could not extract text"}
+        
+        rate_limit()
+        metadata = extract_metadata_with_ai(text, report_type, api_key, client=client)
+        if "error" in metadata:
+            return {"filename": file.name, "error": metadata["error"]}
+        
+        metadata["_filename"] = file.name
+        metadata["_file_hash"] = file_content_hash(file)
+        return {"filename": file.name, "metadata": metadata}
+    except Exception as e:
+        return {"filename": file.name, "error": str(e)}
+
+def extract_batch_metadata(files: list, report_type: str, api_key: str,
+                           max_workers: int = BATCH_MAX_WORKERS,
+                           requests_per_minute: int = BATCH_REQUESTS_PER_MINUTE,
+                           on_progress=None, client=None) -> list:
+    """Extract metadata from many files with bounded concurrency.
+    
+    Text extraction and Claude calls overlap across a thread pool, with Claude
+    calls throttled to the per-minute budget. on_progress(done, total, outcome)
+    is called on the calling thread as each file finishes, so it may update
+    Streamlit elements. Returns one outcome dict per file, in upload order.
+    
+    Every result is recorded in the batch import store. Files already
+    extracted in an earlier run are taken from the store instead of being
+    processed again, and their outcomes are flagged "resumed".
+    """
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
+    
+    rate_limit = make_rate_limiter(requests_per_minute)
+    outcomes = [None] * len(files)
+    file_hashes = [file_content_hash(file) for file in files]
+    stored = batch_store_get(file_hashes, report_type)
+    
+    done = 0
+    pending = []
+    for i, (file, file_hash) in enumerate(zip(files, file_hashes)):
+        record = stored.get(file_hash)
+        if record and record["status"] in BATCH_COMPLETED_STATUSES and record["metadata"]:
+            metadata = record["metadata"]
+            metadata["_filename"] = file.name
+            outcomes[i] = {"filename": file.name, "metadata": metadata, "resumed": True}
+            done += 1
+            if on_progress:
+                on_progress(done, len(files), outcomes[i])
+        else:
+            pending.append(i)
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(_extract_file_metadata, files[i], report_type, api_key, rate_limit, client): i
+            for i in pending
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            outcome = future.result()
+            outcomes[i] = outcome
+            if "metadata" in outcome:
+                batch_store_record(file_hashes[i], report_type, files[i].name, "extracted", metadata=outcome["metadata"])
+            else:
+                batch_store_record(file_hashes[i], report_type, files[i].name, "error", error=outcome["error"])
+            done += 1
+            if on_progress:
+                on_progress(done, len(files), outcome)
+    
+    return outcomes
+
+def render_batch_concurrency_settings() -> tuple:
+    """Render worker/rate controls for batch extraction."""
+    with st.expander("Extraction speed", expanded=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            max_workers = st.number_input(
+                "Parallel workers",
+                min_value=1,
+                max_value=16,
+                value=BATCH_MAX_WORKERS,
+                key="batch_max_workers",
+                help="Files processed at the same time."
+            )
+        with col2:
+            requests_per_minute = st.number_input(
+                "Claude requests per minute",
+                min_value=0,
+                max_value=1000,
+                value=BATCH_REQUESTS_PER_MINUTE,
+                key="batch_requests_per_minute",
+                help="Rate budget for extraction calls. 0 disables throttling."
+            )
+    return int(max_workers), int(requests_per_minute)
+
+def render_batch_restore(report_type: str, uploaded_files: list = None):
+    """Offer to restore extractions from an earlier run that were never saved.
+    
+    The store is shared by every session, so only extractions of the files
+    uploaded here are offered, except in admin mode, which sees them all.
+    """
+    if st.session_state.get("batch_metadata"):
+        return
+    if st.session_state.get("admin_mode"):
+        unsaved = batch_store_unsaved(report_type)
+        scope = "files extracted in an earlier run"
+    else:
+        # Keyed by content, so this works after a reload or restart
+        stored = batch_store_get([file_content_hash(file) for file in uploaded_files or []], report_type)
+        unsaved = [record["metadata"] for record in stored.values()
+                   if record["status"] == "extracted" and record["metadata"]]
+        scope = "of the uploaded files were extracted in an earlier run and"
+    if unsaved:
+        st.info(f"{len(unsaved)} {scope} have not been saved yet.")
+        if st.button("Restore Unsaved Extractions", key="restore_batch_metadata"):
+            st.session_state["batch_metadata"] = unsaved
+            st.rerun()
+
+def run_batch_extraction(uploaded_files: list, report_type: str, api_key: str,
+                         max_workers: int, requests_per_minute: int) -> list:
+    """Run concurrent extraction with a progress bar and per-file warnings."""
+    progress = st.progress(0)
+    status = st.empty()
+    
+    def on_progress(done, total, outcome):
+        progress.progress(done / total)
+        status.caption(f"Processed {done} of {total} · {outcome['filename']}")
+        if "error" in outcome:
+            st.warning(f"Error with {outcome['filename']}: {outcome['error']}")
+    
+    outcomes = extract_batch_metadata(
+        uploaded_files, report_type, api_key,
+        max_workers=max_workers,
+        requests_per_minute=requests_per_minute,
+        on_progress=on_progress
+    )
+    status.empty()
+    
+    resumed = sum(1 for outcome in outcomes if outcome.get("resumed"))
+    if resumed:
+        st.info(f"Reused {resumed} files already extracted in an earlier run")
+    
+    return [outcome["metadata"] for outcome in outcomes if "metadata" in outcome]
+
+# ============================================================================
+# MESSAGE BATCHES (ASYNCHRONOUS BULK EXTRACTION)
+# ============================================================================
+
+@st.cache_resource
+def _message_batch_jobs_lock() -> threading.Lock:
+    """Serialize changes to the batch jobs file across sessions."""
+    return threading.Lock()
+
+def load_message_batch_jobs() -> list:
+    """Load submitted batch jobs from disk so they survive browser reloads."""
+    try:
+        with open(MESSAGE_BATCHES_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def save_message_batch_jobs(jobs: list):
+    """Persist batch jobs atomically. Callers hold _message_batch_jobs_lock."""
+    os.makedirs(os.path.dirname(MESSAGE_BATCHES_PATH) or ".", exist_ok=True)
+    tmp_path = f"{MESSAGE_BATCHES_PATH}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(jobs, f, indent=2)
+    os.replace(tmp_path, MESSAGE_BATCHES_PATH)
+
+def _update_message_batch_job(job: dict, fields: tuple = None):
+    """Store a job, or only the given fields of an already stored one.
+    
+    Writing just the fields that changed keeps a session holding an older
+    copy of the job from undoing another session's update (e.g. "ingested").
+    """
+    with _message_batch_jobs_lock():
+        jobs = load_message_batch_jobs()
+        stored = next((j for j in jobs if j["batch_id"] == job["batch_id"]), None)
+        if stored is not None and fields:
+            stored.update({field: job[field] for field in fields})
+        else:
+            jobs = [j for j in jobs if j["batch_id"] != job["batch_id"]] + [job]
+        save_message_batch_jobs(jobs)
+
+def _remove_message_batch_job(batch_id: str):
+    with _message_batch_jobs_lock():
+        save_message_batch_jobs([j for j in load_message_batch_jobs() if j["batch_id"] != batch_id])
+
+def submit_extraction_batch(files: list, report_type: str, api_key: str, client=None) -> dict:
+    """Submit extraction for all files as one Message Batches job.
+    
+    Files whose extraction is already cached are not resubmitted. Returns the
+    persisted job record, or {"error": ...}.
+    """
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
+    
+    with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+        texts = list(executor.map(process_uploaded_file, files))
+    
+    extraction_prompt = get_extraction_prompt(report_type)
+    file_hashes = [file_content_hash(file) for file in files]
+    stored = batch_store_get(file_hashes, report_type)
+    job_files = {}
+    batch_requests = []
+    
+    for i, (file, text, file_hash) in enumerate(zip(files, texts, file_hashes)):
+        if not text:
+            continue
+        custom_id = f"file-{i:04d}"
+        key = cache_key(text, report_type, EXTRACTION_PROMPT_VERSION, CLAUDE_MODEL)
+        record = stored.get(file_hash)
+        cached = (
+            (record is not None and record["status"] in BATCH_COMPLETED_STATUSES and record["metadata"] is not None)
+            or disk_cache_get("extraction", key) is not None
+        )
+        job_files[custom_id] = {"filename": file.name, "cache_key": key, "cached": cached, "file_hash": file_hash}
+        if not cached:
+            batch_requests.append({
+                "custom_id": custom_id,
+                "params": claude_request_params(extraction_prompt, text)
+            })
+    
+    if not job_files:
+        return {"error": "Could not extract text from any file"}
+    
+    job = {
+        "batch_id": None,
+        "report_type": report_type,
+        "created_at": datetime.now().isoformat(),
+        "status": "ended",
+        "counts": {},
+        "files": job_files,
+        "ingested": False
+    }
+    
+    if batch_requests:
+        try:
+            batch = client.messages.batches.create(requests=batch_requests)
+        except Exception as e:
+            return {"error": str(e)}
+        job["batch_id"] = batch.id
+        job["status"] = batch.processing_status
+    else:
+        # Everything was cached; keep a local-only job so results can be ingested
+        job["batch_id"] = f"local-{cache_key(*sorted(job_files))[:12]}"
+    
+    _update_message_batch_job(job)
+    return job
+
+def refresh_message_batch(job: dict, api_key: str, client=None) -> dict:
+    """Poll the API for a job's processing status and request counts."""
+    if job["batch_id"].startswith("local-"):
+        return job
+    if client is None:
+        client = anthropic.Anthropic(api_key=api_key)
+    
+    batch = client.messages.batches.retrieve(job["batch_id"])
+    counts = batch.request_counts
+    job["status"] = batch.processing_status
+    job["counts"] = {
+        "processing": counts.processing,
+        "succeeded": counts.succeeded,
+        "errored": counts.errored,
+        "canceled": counts.canceled,
+        "expired": counts.expired
+    }
+    _update_message_batch_job(job, fields=("status", "counts"))
+    return job
+
+def ingest_message_batch(job: dict, api_key: str, client=None) -> tuple:
+    """Collect results of an ended job as (metadata list, error list).
+    
+    Successful extractions are also written to the extraction cache, and
+    every file's outcome is recorded in the batch import store.
+    """
+    if client is None and not job["batch_id"].startswith("local-"):
+        client = anthropic.Anthropic(api_key=api_key)
+    
+    results = {}
+    errors = []
+    
+    if not job["batch_id"].startswith("local-"):
+        for entry in client.messages.batches.results(job["batch_id"]):
+            info = job["files"].get(entry.custom_id)
+            if info is None:
+                continue
+            if entry.result.type != "succeeded":
+                error = f"request {entry.result.type}"
+            else:
+                try:
+                    metadata = parse_metadata_response(entry.result.message.content[0].text)
+                except ValueError as e:
+                    metadata = {"error": str(e)}
+                error = metadata.get("error")
+            if error:
+                errors.append(f"{info['filename']}: {error}")
+                if info.get("file_hash"):
+                    batch_store_record(info["file_hash"], job["report_type"], info["filename"], "error", error=error)
+                continue
+            disk_cache_put("extraction", info["cache_key"], metadata, EXTRACTION_CACHE_MAX_BYTES)
+            results[entry.custom_id] = metadata
+    
+    cached_files = {custom_id: info for custom_id, info in job["files"].items() if info["cached"]}
+    stored = batch_store_get(
+        [info["file_hash"] for info in cached_files.values() if info.get("file_hash")], job["report_type"]
+    )
+    for custom_id, info in cached_files.items():
+        metadata = disk_cache_get("extraction", info["cache_key"])
+        if metadata is None and info.get("file_hash") in stored:
+            metadata = stored[info["file_hash"]]["metadata"]
+        if metadata is not None:
+            results[custom_id] = metadata
+        else:
+            errors.append(f"{info['filename']}: cached extraction no longer available")
+    
+    all_metadata = []
+    for custom_id in sorted(results):
+        info = job["files"][custom_id]
+        metadata = results[custom_id]
+        metadata["_filename"] = info["filename"]
+        if info.get("file_hash"):
+            metadata["_file_hash"] = info["file_hash"]
+            record = stored.get(info["file_hash"])
+            if not (record and record["status"] in ("saved", "dismissed")):
+                batch_store_record(info["file_hash"], job["report_type"], info["filename"], "extracted", metadata=metadata)
+        all_metadata.append(metadata)
+    
+    job["ingested"] = True
+    _update_message_batch_job(job, fields=("ingested",))
+    return all_metadata, errors
+
+def render_message_batch_jobs(report_type: str, api_key: str):
+    """List submitted batch jobs with poll and ingest controls."""
+    jobs = load_message_batch_jobs()
+    if not jobs:
+        return
+    
+    st.markdown('<p class="section-header">Batch Jobs</p>', unsafe_allow_html=True)
+    
+    for job in sorted(jobs, key=lambda j: j["created_at"], reverse=True):
+        batch_id = job["batch_id"]
+        counts = job.get("counts", {})
+        summary = f"{job['report_type']} · {len(job['files'])} files · submitted {job['created_at'][:16].replace('T', ' ')}"
+        
+        with st.expander(f"{batch_id} - {job['status']}{' (ingested)' if job.get('ingested') else ''}"):
+            st.caption(summary)
+            if counts:
+                st.caption(" · ".join(f"{count} {name}" for name, count in counts.items() if count))
+            
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                if st.button("Check Status", key=f"poll_{batch_id}", use_container_width=True):
+                    try:
+                        refresh_message_batch(job, api_key)
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Could not check status: {e}")
+            with col2:
+                can_ingest = job["status"] == "ended" and job["report_type"] == report_type and not job.get("ingested")
+                if st.button("Ingest Results", key=f"ingest_{batch_id}", disabled=not can_ingest, use_container_width=True):
+                    try:
+                        all_metadata, errors = ingest_message_batch(job, api_key)
+                    except Exception as e:
+                        st.error(f"Could not ingest results: {e}")
+                    else:
+                        for error in errors:
+                            st.warning(error)
+                        st.session_state["batch_metadata"] = st.session_state.get("batch_metadata", []) + all_metadata
+                        st.success(f"✓ Ingested metadata from {len(all_metadata)} files")
+                if job["status"] == "ended" and job["report_type"] != report_type:
+                    st.caption(f"Select {job['report_type']} above to ingest.")
+            with col3:
+                if st.button("Remove", key=f"remove_{batch_id}", use_container_width=True):
+                    _remove_message_batch_job(batch_id)
+                    st.rerun()
+
 # ============================================================================
 # BATCH IMPORT MODE
 # ============================================================================
 
-def render_batch_import(api_key: str, access_token: str, drive_id: str, item_id: str, 
-                        excel_connected: bool, registry: dict):
+def render_batch_import(api_key: str, storage: dict, registry: dict):
     """Render batch import interface."""
     
     render_uta_header("Batch Import")
@@ -1977,6 +4626,8 @@ def render_batch_import(api_key: str, access_token: str, drive_id: str, item_id:
         key="batch_report_type"
     )
     
+    max_workers, requests_per_minute = render_batch_concurrency_settings()
+    
     uploaded_files = st.file_uploader(
         "Upload reports",
         type=["pdf", "docx", "txt"],
@@ -1988,27 +4639,15 @@ def render_batch_import(api_key: str, access_token: str, drive_id: str, item_id:
         st.write(f"**{len(uploaded_files)} files selected**")
         
         if st.button("Extract Metadata from All Files", type="primary"):
-            all_metadata = []
-            progress = st.progress(0)
-            
-            for i, file in enumerate(uploaded_files):
-                with st.spinner(f"Processing {file.name}..."):
-                    text = process_uploaded_file(file)
-                    if text:
-                        metadata = extract_metadata_with_ai(text, report_type, api_key)
-                        if "error" not in metadata:
-                            metadata["_filename"] = file.name
-                            all_metadata.append(metadata)
-                        else:
-                            st.warning(f"Error extracting from {file.name}: {metadata['error']}")
-                    else:
-                        st.warning(f"Could not extract text from {file.name}")
-                
-                progress.progress((i + 1) / len(uploaded_files))
+            all_metadata = run_batch_extraction(
+                uploaded_files, report_type, api_key, max_workers, requests_per_minute
+            )
             
             st.session_state["batch_metadata"] = all_metadata
             st.success(f"Extracted metadata from {len(all_metadata)} files")
     
+    render_batch_restore(report_type, uploaded_files)
+    
     # Show extracted metadata for review
     if st.session_state.get("batch_metadata"):
         st.divider()
@@ -2021,37 +4660,30 @@ def render_batch_import(api_key: str, access_token: str, drive_id: str, item_id:
         col1, col2 = st.columns(2)
         
         with col1:
-            if st.button("💾 Save All to Excel Online", type="primary"):
-                if not excel_connected or not access_token:
-                    st.error("Excel Online not connected. Configure in sidebar.")
+            if st.button(f"💾 Save All to {storage_label(storage)}", type="primary"):
+                if not storage:
+                    st.error(storage_unavailable_message())
                 else:
-                    success_count = 0
-                    for metadata in st.session_state["batch_metadata"]:
-                        # Generate unit_id
-                        match = find_matching_unit(
-                            metadata.get("unit_name", ""),
-                            metadata.get("unit_type", "Academic"),
-                            registry
-                        )
-                        if match["match"]:
-                            metadata["unit_id"] = match["match"].get("unit_id")
-                            metadata["canonical_name"] = match["match"].get("canonical_name")
-                        else:
-                            metadata["unit_id"] = generate_unit_id(
-                                metadata.get("unit_name", ""),
-                                metadata.get("college_division", ""),
-                                metadata.get("unit_type", "Academic")
-                            )
-                        
-                        rows = prepare_rows_for_sheet(metadata, report_type)
-                        if save_metadata_to_excel_online(access_token, drive_id, item_id, rows, report_type):
-                            success_count += 1
+                    batch_metadata = st.session_state["batch_metadata"]
+                    resolve_unit_ids(batch_metadata, registry)
+                    
+                    save_stats = {}
+                    reports_rows = [prepare_rows_for_sheet(metadata, report_type) for metadata in batch_metadata]
+                    saved = save_reports(storage, reports_rows, report_type, stats=save_stats)
+                    # Reports whose rows didn't all reach the sheet stay restorable
+                    saved_metadata = [metadata for metadata, ok in zip(batch_metadata, saved) if ok]
+                    batch_store_set_status(saved_metadata, report_type, "saved")
                     
-                    st.success(f"Saved {success_count} of {len(st.session_state['batch_metadata'])} reports")
-                    st.session_state["batch_metadata"] = []
+                    save_message = f"Saved {len(saved_metadata)} of {len(batch_metadata)} reports ({save_stats.get('requests', 0)} requests)"
+                    if len(saved_metadata) == len(batch_metadata):
+                        st.success(save_message)
+                    else:
+                        st.warning(f"{save_message}. Unsaved reports are kept below.")
+                    st.session_state["batch_metadata"] = [metadata for metadata, ok in zip(batch_metadata, saved) if not ok]
         
         with col2:
             if st.button("🗑️ Clear All"):
+                batch_store_set_status(st.session_state["batch_metadata"], report_type, "dismissed")
                 st.session_state["batch_metadata"] = []
                 st.rerun()
 
@@ -2074,7 +4706,8 @@ def render_admin_panel():
         "Improvement Prompt",
         "Plan Prompt",
         "Custom Rubric",
-        "Unit Registry"
+        "Unit Registry",
+        "Performance"
     ])
     
     # NEW: Good Examples Tab
@@ -2226,9 +4859,16 @@ def render_admin_panel():
     
     with tabs[7]:
         st.subheader("Unit Registry Management")
-        st.caption("View, edit, and add unit names. Changes are saved to session.")
+        st.caption("View, edit, and add unit names. Changes apply to the shared registry used by every session.")
         
-        registry = load_unit_registry()
+        # Edits apply to a copy that is then published to every session
+        registry = editable_unit_registry()
+        st.caption(f"Registry version {unit_registry_version()}")
+        persist_registry = st.checkbox(
+            "Also save changes to the registry CSV files",
+            key="persist_registry",
+            help="Without this, edits last until the server restarts."
+        )
         
         # Display and edit registry
         reg_tab1, reg_tab2 = st.tabs(["Academic Units", "Administrative Units"])
@@ -2256,7 +4896,7 @@ def render_admin_panel():
                             "active": new_acad_active
                         }
                         registry["academic"].append(new_unit)
-                        st.session_state["unit_registry"] = registry
+                        publish_unit_registry(registry, persist=persist_registry)
                         st.success(f"✓ Added: {new_acad_name} (ID: {new_unit_id})")
                         st.rerun()
                     else:
@@ -2290,7 +4930,7 @@ def render_admin_panel():
                         record["unit_type"] = "Academic"
                         updated_units.append(record)
                     registry["academic"] = updated_units
-                    st.session_state["unit_registry"] = registry
+                    publish_unit_registry(registry, persist=persist_registry)
                     st.success("✓ Academic units saved!")
             else:
                 st.info("No academic units loaded. Add one above or upload a CSV below.")
@@ -2318,7 +4958,7 @@ def render_admin_panel():
                             "active": new_admin_active
                         }
                         registry["administrative"].append(new_unit)
-                        st.session_state["unit_registry"] = registry
+                        publish_unit_registry(registry, persist=persist_registry)
                         st.success(f"✓ Added: {new_admin_name} (ID: {new_unit_id})")
                         st.rerun()
                     else:
@@ -2351,7 +4991,7 @@ def render_admin_panel():
                         record["unit_type"] = "Administrative"
                         updated_units.append(record)
                     registry["administrative"] = updated_units
-                    st.session_state["unit_registry"] = registry
+                    publish_unit_registry(registry, persist=persist_registry)
                     st.success("✓ Administrative units saved!")
             else:
                 st.info("No administrative units loaded. Add one above or upload a CSV below.")
@@ -2362,7 +5002,8 @@ def render_admin_panel():
         col1, col2 = st.columns(2)
         with col1:
             academic_upload = st.file_uploader("Academic Units CSV", type=["csv"], key="academic_csv")
-            if academic_upload:
+            # Publish each upload once rather than on every rerun
+            if academic_upload and st.session_state.get("published_academic_csv") != academic_upload.file_id:
                 df = pd.read_csv(academic_upload)
                 # Process into registry format
                 new_academic = []
@@ -2381,12 +5022,13 @@ def render_admin_panel():
                         "active": "Yes"
                     })
                 registry["academic"] = new_academic
-                st.session_state["unit_registry"] = registry
+                publish_unit_registry(registry, persist=persist_registry)
+                st.session_state["published_academic_csv"] = academic_upload.file_id
                 st.success(f"Loaded {len(new_academic)} academic units")
         
         with col2:
             admin_upload = st.file_uploader("Administrative Units CSV", type=["csv"], key="admin_csv")
-            if admin_upload:
+            if admin_upload and st.session_state.get("published_admin_csv") != admin_upload.file_id:
                 df = pd.read_csv(admin_upload)
                 new_admin = []
                 for _, row in df.iterrows():
@@ -2404,13 +5046,180 @@ def render_admin_panel():
                         "active": "Yes"
                     })
                 registry["administrative"] = new_admin
-                st.session_state["unit_registry"] = registry
+                publish_unit_registry(registry, persist=persist_registry)
+                st.session_state["published_admin_csv"] = admin_upload.file_id
                 st.success(f"Loaded {len(new_admin)} administrative units")
+    
+    with tabs[8]:
+        st.subheader("Performance")
+        st.caption("Cached results are reused for identical inputs. Clear a cache after changing models or to force fresh results.")
+        
+        st.markdown("**Metadata Extraction**")
+        extraction_stats = disk_cache_stats("extraction")
+        st.caption(
+            f"{extraction_stats['entries']} cached extractions · "
+            f"{extraction_stats['bytes'] / 1024:.1f} KB of {EXTRACTION_CACHE_MAX_BYTES / (1024 * 1024):.0f} MB · "
+            f"prompt version {EXTRACTION_PROMPT_VERSION}"
+        )
+        extraction_counters = get_cache_counters("extraction")
+        st.caption(f"Since server start: {extraction_counters['hits']} hits · {extraction_counters['misses']} misses")
+        if st.button("Invalidate Extraction Cache", key="clear_extraction_cache"):
+            removed = disk_cache_clear("extraction")
+            st.success(f"✓ Removed {removed} cached extractions")
+        
+        st.divider()
+        st.markdown("**Report Analysis**")
+        analysis_stats = disk_cache_stats("analysis")
+        analysis_counters = get_cache_counters("analysis")
+        st.caption(
+            f"{analysis_stats['entries']} cached analyses · "
+            f"{analysis_stats['bytes'] / 1024:.1f} KB of {ANALYSIS_CACHE_MAX_BYTES / (1024 * 1024):.0f} MB"
+        )
+        st.caption(
+            f"Since server start: {analysis_counters['hits']} hits · {analysis_counters['misses']} misses · "
+            f"saved ${analysis_counters['saved_cost']:.4f}"
+        )
+        if st.button("Invalidate Analysis Cache", key="clear_analysis_cache"):
+            removed = disk_cache_clear("analysis")
+            st.success(f"✓ Removed {removed} cached analyses")
+        
+        st.divider()
+        st.markdown("**Extracted Text**")
+        text_info = text_cache_info()
+        text_counters = get_cache_counters("text")
+        text_lookups = text_counters["hits"] + text_counters["misses"]
+        st.caption(
+            f"{text_info['entries']} of {TEXT_CACHE_MAX_ENTRIES} files in memory · "
+            f"{text_info['chars'] / 1024:.1f}K characters · extractor version {TEXT_EXTRACTOR_VERSION}"
+        )
+        st.caption(
+            f"Since server start: {text_counters['hits']} hits · {text_counters['misses']} misses"
+            + (f" · {text_counters['hits'] / text_lookups:.0%} hit rate" if text_lookups else "")
+        )
+        if TEXT_CACHE_MAX_BYTES > 0:
+            text_disk_stats = disk_cache_stats("text")
+            st.caption(
+                f"{text_disk_stats['entries']} files on disk · "
+                f"{text_disk_stats['bytes'] / 1024:.1f} KB of {TEXT_CACHE_MAX_BYTES / (1024 * 1024):.0f} MB"
+            )
+        if st.button("Invalidate Text Cache", key="clear_text_cache"):
+            removed = clear_text_cache()
+            st.success(f"✓ Removed {removed} cached files")
+        
+        st.divider()
+        st.markdown("**Worksheet Data**")
+        worksheet_info = worksheet_cache_info()
+        worksheet_counters = get_cache_counters("worksheets")
+        st.caption(
+            f"{worksheet_info['sheets']} sheets ({worksheet_info['rows']} rows) in memory · "
+            f"revalidated after {WORKSHEET_CACHE_TTL:.0f}s · "
+            f"{worksheet_counters['hits']} hits · {worksheet_counters['misses']} downloads"
+        )
+        if WORKSHEET_CACHE_MAX_BYTES > 0:
+            worksheet_disk_stats = disk_cache_stats("worksheets")
+            st.caption(
+                f"{worksheet_disk_stats['entries']} snapshots on disk · "
+                f"{worksheet_disk_stats['bytes'] / 1024:.1f} KB of {WORKSHEET_CACHE_MAX_BYTES / (1024 * 1024):.0f} MB"
+            )
+        if st.button("Invalidate Worksheet Cache", key="clear_worksheet_cache"):
+            worksheet_cache = _worksheet_cache()
+            with worksheet_cache["lock"]:
+                worksheet_cache["entries"].clear()
+            removed = disk_cache_clear("worksheets")
+            st.success(f"✓ Cleared cached worksheets ({removed} on disk)")
+        
+        st.divider()
+        st.markdown("**Analytics Mirror**")
+        mirror_summary = analytics_mirror_summary()
+        if mirror_summary:
+            st.caption(" · ".join(
+                f"{sheet_name}: {info['rows']:,} rows (synced {info['synced_at']})"
+                for sheet_name, info in mirror_summary.items()
+            ))
+            if st.button("Rebuild Analytics Mirror", key="clear_analytics_mirror",
+                         help="Delete the mirror; the Explore page rebuilds it on its next visit"):
+                clear_analytics_mirror()
+                st.success("✓ Analytics mirror cleared")
+        else:
+            st.caption("Not built yet; it is created the first time the Explore page is opened.")
+        
+        st.divider()
+        st.markdown("**Batch Import History**")
+        store_summary = batch_store_summary()
+        if store_summary:
+            st.caption(" · ".join(f"{count} {status}" for status, count in sorted(store_summary.items())))
+            if st.button("Clear Batch Import History", key="clear_batch_store"):
+                removed = batch_store_clear()
+                st.success(f"✓ Forgot {removed} files")
+        else:
+            st.caption("No batch imports recorded yet.")
+        
+        st.divider()
+        st.markdown("**Background Analyses**")
+        jobs_info = analysis_jobs_info()
+        st.caption(
+            f"{jobs_info['running']} running · {jobs_info['finished']} finished awaiting pickup · "
+            f"{ANALYSIS_JOB_WORKERS} worker threads"
+        )
+        
+        st.divider()
+        st.markdown("**Microsoft Graph Requests**")
+        graph_metrics = get_graph_metrics() if EXCEL_ONLINE_SUPPORT else {}
+        if graph_metrics:
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "endpoint": endpoint,
+                        "requests": entry["requests"],
+                        "errors": entry["errors"],
+                        "retries": entry["retries"],
+                        "avg_ms": round(entry["total_seconds"] / entry["requests"] * 1000) if entry["requests"] else 0,
+                        "max_ms": round(entry["max_seconds"] * 1000)
+                    }
+                    for endpoint, entry in sorted(graph_metrics.items())
+                ]),
+                use_container_width=True,
+                hide_index=True
+            )
+        else:
+            st.caption("No Graph requests since server start.")
 
 # ============================================================================
 # MAIN APPLICATION
 # ============================================================================
 
+def render_local_workbook_status(path: str, access_token: str, drive_id: str, item_id: str,
+                                 excel_connected: bool):
+    """Show the local workbook's sync state and sync controls in the sidebar."""
+    status = local_workbook_sync_status(path)
+    st.markdown('<span class="status-pill status-connected">● Local Workbook</span>', unsafe_allow_html=True)
+    synced_at = f" · last sync {status['synced_at']}" if status["synced_at"] else ""
+    st.caption(f"{status['rows']:,} rows · {status['pending']} unit-years not yet synced{synced_at}")
+    
+    last_sync = last_local_workbook_sync(path)
+    if last_sync and (last_sync["failed"] or last_sync.get("error")):
+        st.warning(f"Last background sync failed: {last_sync.get('error') or ', '.join(last_sync['failed'])}")
+    
+    if not excel_connected:
+        return
+    
+    if st.button("Sync to Excel Online", key="sync_local_workbook", use_container_width=True,
+                 disabled=status["running"] or not status["pending"]):
+        sync_stats = {}
+        with st.spinner("Syncing..."):
+            result = sync_local_workbook_to_excel(path, access_token, drive_id, item_id, stats=sync_stats)
+        if result["failed"]:
+            st.error(f"Sync failed for {', '.join(result['failed'])}")
+        else:
+            st.success(f"✓ Synced {result['groups']} unit-years ({sync_stats['requests']} requests)")
+    
+    if st.button("Load from Excel Online", key="load_local_workbook", use_container_width=True,
+                 disabled=status["running"],
+                 help="Replace the local workbook with the current Excel Online data. Local changes that were not synced are lost."):
+        with st.spinner("Downloading..."):
+            if load_local_workbook_from_excel(path, access_token, drive_id, item_id):
+                st.success("✓ Local workbook updated")
+
 def main():
     """Main application entry point."""
     
@@ -2467,6 +5276,13 @@ def main():
                 st.session_state["current_page"] = "batch"
                 st.rerun()
         
+        if st.session_state["current_page"] == "explore":
+            st.button("● Explore", key="nav_explore", use_container_width=True, type="primary", disabled=True)
+        else:
+            if st.button("Explore", key="nav_explore", use_container_width=True):
+                st.session_state["current_page"] = "explore"
+                st.rerun()
+        
         if st.session_state["admin_mode"]:
             if st.session_state["current_page"] == "config":
                 st.button("● Configuration", key="nav_config", use_container_width=True, type="primary", disabled=True)
@@ -2528,6 +5344,23 @@ def main():
             else:
                 st.markdown('<span class="status-pill status-disconnected">○ Excel Not Configured</span>', unsafe_allow_html=True)
         
+        # Metadata storage: the local workbook when configured, else Excel Online
+        storage = None
+        if STORAGE_BACKEND == "local" and LOCAL_WORKBOOK_SUPPORT:
+            storage = local_storage()
+        elif STORAGE_BACKEND == "excel" and excel_connected:
+            storage = excel_storage(access_token, ms_drive_id, ms_item_id)
+        elif STORAGE_BACKEND != "excel":
+            # Don't quietly fall back to Excel Online when another backend was asked for
+            st.error(storage_unavailable_message())
+        
+        if storage and storage["backend"] == "local":
+            if excel_connected and LOCAL_SYNC_INTERVAL > 0:
+                start_local_workbook_sync(storage["path"], access_token, ms_drive_id, ms_item_id,
+                                          min_interval=LOCAL_SYNC_INTERVAL)
+            if st.session_state["admin_mode"]:
+                render_local_workbook_status(storage["path"], access_token, ms_drive_id, ms_item_id, excel_connected)
+        
         # User mode indicator
         st.markdown("<br>", unsafe_allow_html=True)
         if st.session_state["admin_mode"]:
@@ -2547,9 +5380,11 @@ def main():
     
     # Main content area based on current page
     if st.session_state["current_page"] == "analyze":
-        render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_connected, registry)
+        render_analyze_page(api_key, storage, registry)
     elif st.session_state["current_page"] == "batch":
-        render_batch_page(api_key, access_token, ms_drive_id, ms_item_id, excel_connected, registry)
+        render_batch_page(api_key, storage, registry)
+    elif st.session_state["current_page"] == "explore":
+        render_explore_page(storage)
     elif st.session_state["current_page"] == "config" and st.session_state["admin_mode"]:
         render_admin_panel()
     
@@ -2557,7 +5392,7 @@ def main():
     render_uta_footer()
 
 
-def render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_connected, registry):
+def render_analyze_page(api_key, storage, registry):
     """Render the main analysis page with clean design."""
     
     render_uta_header("Analyze Report")
@@ -2565,6 +5400,17 @@ def render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_co
     # Two column layout
     col1, col2 = st.columns([1, 1], gap="large")
     
+    with col2:
+        # RESULTS SECTION (header and live output come first so analysis can
+        # stream into this column while the upload column handles the click)
+        st.markdown('<p class="section-header">Analysis Results</p>', unsafe_allow_html=True)
+        live_output = st.empty()
+    
+    def show_live_output(text):
+        live_output.markdown(text + " ▌")
+    
+    job_running = False
+    
     with col1:
         # UPLOAD SECTION
         st.markdown('<p class="section-header">Upload</p>', unsafe_allow_html=True)
@@ -2584,82 +5430,95 @@ def render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_co
         if uploaded_file:
             st.success(f"✓ {uploaded_file.name}")
             
+            extraction_stats = {}
             with st.spinner("Extracting text..."):
-                report_text = process_uploaded_file(uploaded_file)
+                report_text = process_uploaded_file(uploaded_file, stats=extraction_stats)
+            
+            if extraction_stats.get("truncated"):
+                st.warning(
+                    f"Only the first {extraction_stats['pages_read']} of {extraction_stats['pages_total']} "
+                    f"pages were read (limit {PDF_MAX_PAGES})."
+                )
             
             if report_text:
                 with st.expander("Preview extracted text", expanded=False):
+                    if extraction_stats.get("cached"):
+                        st.caption("Reused text extracted earlier from this file")
+                    if extraction_stats.get("pages_read"):
+                        st.caption(
+                            f"{extraction_stats['pages_read']} pages in {extraction_stats['seconds']:.1f}s "
+                            f"({extraction_stats['mode']}) · slowest page {max(extraction_stats['page_seconds']):.2f}s"
+                        )
+                    if extraction_stats.get("chars_saved", 0) > 0:
+                        st.caption(
+                            f"Compact tables saved {extraction_stats['chars_saved']:,} characters "
+                            f"(~{extraction_stats['tokens_saved']:,} tokens)"
+                        )
                     st.text(report_text[:3000] + "..." if len(report_text) > 3000 else report_text)
                 
                 st.markdown("<br>", unsafe_allow_html=True)
                 
+                combined_mode = st.checkbox(
+                    "Single-pass mode",
+                    key="combined_mode",
+                    help="Extract metadata and analyze in one Claude call. Historical stagnation and previous-improvement context are not included in this mode."
+                )
+                
+                job_key = analysis_job_key(hashlib.sha256(uploaded_file.getvalue()).hexdigest(), report_type)
+                
                 if st.button("Analyze Report", type="primary", use_container_width=True):
                     if not api_key:
                         st.error("API key not configured.")
                     else:
-                        # Extract metadata
-                        with st.spinner("Extracting metadata..."):
-                            metadata = extract_metadata_with_ai(report_text, report_type, api_key)
-                        
-                        if "error" in metadata:
-                            st.error(f"Error: {metadata['error']}")
-                        else:
-                            st.session_state["extracted_metadata"] = metadata
-                            st.session_state["filename"] = uploaded_file.name
-                        
-                        # Historical context
-                        stagnation_info = None
-                        previous_improvements = None
-                        
-                        if excel_connected and access_token and ms_drive_id and ms_item_id and metadata.get("unit_id"):
-                            if report_type == "Results Report":
-                                for outcome in metadata.get("outcomes", []):
-                                    stag = check_stagnation(
-                                        access_token, ms_drive_id, ms_item_id,
-                                        metadata.get("unit_id", ""),
-                                        outcome.get("outcome_id", ""),
-                                        outcome.get("assessment_method", ""),
-                                        metadata.get("academic_year", "")
-                                    )
-                                    if stag.get("stagnant"):
-                                        stagnation_info = stag
-                                        break
-                            
-                            elif report_type == "Improvement Report":
-                                match = find_matching_unit(
-                                    metadata.get("unit_name", ""),
-                                    metadata.get("unit_type", "Academic"),
-                                    registry
-                                )
-                                if match["match"]:
-                                    previous_improvements = get_previous_improvements_excel(
-                                        access_token, ms_drive_id, ms_item_id,
-                                        match["match"].get("unit_id", "")
-                                    )
-                        
-                        # Run analysis
-                        with st.spinner("Analyzing..."):
-                            results = analyze_report(
-                                report_text, 
-                                report_type, 
-                                api_key,
-                                stagnation_info,
-                                previous_improvements
-                            )
-                        
-                        if "error" in results:
-                            st.error(f"Error: {results['error']}")
-                        else:
-                            st.session_state["results"] = results
+                        # Runs on a shared worker thread, so reruns and other
+                        # widgets don't interrupt it
+                        submit_analysis_job(
+                            job_key,
+                            uploaded_file.name,
+                            report_text=report_text,
+                            report_type=report_type,
+                            api_key=api_key,
+                            settings=snapshot_prompt_settings(),
+                            combined=combined_mode,
+                            history=storage,
+                            registry=registry
+                        )
+                
+                job = get_analysis_job(job_key)
+                if job and job["status"] == "running":
+                    job_running = True
+                    st.info(f"⏳ {job['stage']} You can keep using the page; results appear here when ready.")
+                    if job["partial"]:
+                        show_live_output(job["partial"])
+                elif job:
+                    pop_analysis_job(job_key)
+                    for error in job["errors"]:
+                        st.error(f"Error: {error}")
+                    if job["metadata"] and "error" not in job["metadata"]:
+                        st.session_state["extracted_metadata"] = job["metadata"]
+                        st.session_state["filename"] = job["filename"]
+                    if job["results"]:
+                        st.session_state["results"] = job["results"]
     
     with col2:
-        # RESULTS SECTION
-        st.markdown('<p class="section-header">Analysis Results</p>', unsafe_allow_html=True)
-        
-        if st.session_state.get("results"):
+        if st.session_state.get("results") and not job_running:
             results = st.session_state["results"]
             
-            st.caption(f"Cost: {results['cost']} · {results['tokens']['input']} in / {results['tokens']['output']} out tokens")
+            if results.get("cached"):
+                st.caption(f"Cost: {results['cost']} · served from cache (saved {results['saved_cost']}) · {results['tokens']['input']} in / {results['tokens']['output']} out tokens")
+            else:
+                st.caption(f"Cost: {results['cost']} · {results['tokens']['input']} in / {results['tokens']['output']} out tokens")
+            if results.get("timing") and not results.get("cached"):
+                st.caption(f"First token in {results['timing']['first_token'] or 0:.1f}s · {results['timing']['total']:.1f}s total")
+            if results['tokens'].get("cache_read") or results['tokens'].get("cache_write"):
+                st.caption(f"Prompt cache: {results['tokens'].get('cache_read', 0):,} read / {results['tokens'].get('cache_write', 0):,} written tokens")
+            if results.get("stagnant_outcomes"):
+                st.caption(f"Stagnation check flagged: {', '.join(str(o) for o in results['stagnant_outcomes'])}")
+            if results.get("token_savings", {}).get("requests"):
+                st.caption(f"Single pass saved 1 request and ~{results['token_savings']['input']:,} input tokens")
+            if results.get("fallback"):
+                # The cost above covers the analysis call only
+                st.warning(f"{results['fallback']}; the cost shown doesn't include the extraction call.")
             
             # Formatted display
             st.markdown('<div class="results-card">', unsafe_allow_html=True)
@@ -2683,7 +5542,7 @@ def render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_co
                 plain_text = plain_text.replace("✓", "").replace("✎", "")
                 st.caption("Click the copy icon in the top-right corner of the box below:")
                 st.code(plain_text, language=None)
-        else:
+        elif not job_running:
             st.info("Upload a report and click 'Analyze Report' to see results.")
         
         # METADATA SECTION
@@ -2701,13 +5560,14 @@ def render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_co
             col_a, col_b = st.columns(2)
             
             with col_a:
-                if st.button("Save to Excel Online", type="primary", use_container_width=True):
-                    if not excel_connected or not access_token:
-                        st.error("Excel Online not connected.")
+                if st.button(f"Save to {storage_label(storage)}", type="primary", use_container_width=True):
+                    if not storage:
+                        st.error(storage_unavailable_message())
                     else:
                         rows = prepare_rows_for_sheet(edited_metadata, report_type)
-                        if save_metadata_to_excel_online(access_token, ms_drive_id, ms_item_id, rows, report_type):
-                            st.success("✓ Saved!")
+                        save_stats = {}
+                        if save_metadata(storage, rows, report_type, stats=save_stats):
+                            st.success(f"✓ Saved! ({save_stats['requests']} requests)")
                             st.session_state["extracted_metadata"] = None
                         else:
                             st.error("Save failed.")
@@ -2727,9 +5587,14 @@ def render_analyze_page(api_key, access_token, ms_drive_id, ms_item_id, excel_co
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     use_container_width=True
                 )
+    
+    # Poll the running job; each rerun picks up its progress
+    if job_running:
+        time.sleep(ANALYSIS_JOB_POLL_SECONDS)
+        st.rerun()
 
 
-def render_batch_page(api_key, access_token, ms_drive_id, ms_item_id, excel_connected, registry):
+def render_batch_page(api_key, storage, registry):
     """Render batch import page with clean design."""
     
     render_uta_header("Batch Import")
@@ -2744,6 +5609,8 @@ def render_batch_page(api_key, access_token, ms_drive_id, ms_item_id, excel_conn
         key="batch_report_type"
     )
     
+    max_workers, requests_per_minute = render_batch_concurrency_settings()
+    
     st.markdown('<p class="section-header">Files</p>', unsafe_allow_html=True)
     
     uploaded_files = st.file_uploader(
@@ -2756,45 +5623,122 @@ def render_batch_page(api_key, access_token, ms_drive_id, ms_item_id, excel_conn
     if uploaded_files:
         st.success(f"✓ {len(uploaded_files)} files selected")
         
-        if st.button("Extract Metadata from All Files", type="primary"):
-            all_metadata = []
-            progress = st.progress(0)
-            
-            for i, file in enumerate(uploaded_files):
-                with st.spinner(f"Processing {file.name}..."):
-                    text = process_uploaded_file(file)
-                    if text:
-                        metadata = extract_metadata_with_ai(text, report_type, api_key)
-                        if "error" not in metadata:
-                            metadata["_filename"] = file.name
-                            all_metadata.append(metadata)
-                        else:
-                            st.warning(f"Error with {file.name}: {metadata['error']}")
-                progress.progress((i + 1) / len(uploaded_files))
+        submit_as_batch = st.checkbox(
+            "Submit as batch job",
+            key="batch_submit_mode",
+            help="Send all extractions as one Message Batches job at half the cost. Results are usually ready within an hour (at most 24 hours) and can be ingested later, even after a reload."
+        )
+        
+        if submit_as_batch:
+            if st.button("Submit Batch Job", type="primary"):
+                if not api_key:
+                    st.error("API key not configured.")
+                else:
+                    with st.spinner("Submitting batch job..."):
+                        job = submit_extraction_batch(uploaded_files, report_type, api_key)
+                    if "error" in job:
+                        st.error(f"Error: {job['error']}")
+                    else:
+                        st.success(f"✓ Submitted {len(job['files'])} files as {job['batch_id']}")
+        elif st.button("Extract Metadata from All Files", type="primary"):
+            all_metadata = run_batch_extraction(
+                uploaded_files, report_type, api_key, max_workers, requests_per_minute
+            )
             
             st.session_state["batch_metadata"] = all_metadata
             st.success(f"✓ Extracted metadata from {len(all_metadata)} files")
+    
+    render_message_batch_jobs(report_type, api_key)
+    render_batch_restore(report_type, uploaded_files)
+    
+    if st.session_state.get("batch_metadata"):
+        st.markdown('<p class="section-header">Extracted Data</p>', unsafe_allow_html=True)
         
-        if st.session_state.get("batch_metadata"):
-            st.markdown('<p class="section-header">Extracted Data</p>', unsafe_allow_html=True)
-            
-            for meta in st.session_state["batch_metadata"]:
-                with st.expander(f"{meta.get('_filename', 'Unknown')} - {meta.get('unit_name', 'Unknown Unit')}"):
-                    st.json(meta)
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.button("Save All to Excel Online", type="primary", use_container_width=True):
-                    if not excel_connected or not access_token:
-                        st.error("Excel Online not connected.")
+        for meta in st.session_state["batch_metadata"]:
+            with st.expander(f"{meta.get('_filename', 'Unknown')} - {meta.get('unit_name', 'Unknown Unit')}"):
+                st.json(meta)
+        
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button(f"Save All to {storage_label(storage)}", type="primary", use_container_width=True):
+                if not storage:
+                    st.error(storage_unavailable_message())
+                else:
+                    batch_metadata = st.session_state["batch_metadata"]
+                    # Without a unit id every report would share one blank key
+                    resolve_unit_ids(batch_metadata, registry)
+                    
+                    save_stats = {}
+                    reports_rows = [prepare_rows_for_sheet(meta, report_type) for meta in batch_metadata]
+                    saved = save_reports(storage, reports_rows, report_type, stats=save_stats)
+                    # Reports whose rows didn't all reach the sheet stay restorable
+                    saved_metadata = [meta for meta, ok in zip(batch_metadata, saved) if ok]
+                    batch_store_set_status(saved_metadata, report_type, "saved")
+                    success_count = len(saved_metadata)
+                    save_message = f"Saved {success_count} of {len(batch_metadata)} records ({save_stats.get('requests', 0)} requests)"
+                    if success_count == len(batch_metadata):
+                        st.success(f"✓ {save_message}")
                     else:
-                        success_count = 0
-                        for meta in st.session_state["batch_metadata"]:
-                            rows = prepare_rows_for_sheet(meta, report_type)
-                            if save_metadata_to_excel_online(access_token, ms_drive_id, ms_item_id, rows, report_type):
-                                success_count += 1
-                        st.success(f"✓ Saved {success_count} of {len(st.session_state['batch_metadata'])} records")
+                        st.warning(f"{save_message}. The others were not fully written; save again to retry.")
+
+
+def render_explore_page(storage):
+    """Render the cross-unit query page over the analytics mirror."""
+    
+    render_uta_header("Explore")
+    
+    if not storage:
+        st.info("Connect Excel Online or configure a local workbook to explore saved metadata.")
+        return
+    
+    report_type = st.selectbox("Report Type", REPORT_TYPES, key="explore_report_type")
+    sheet_name, _ = get_sheet_schema(report_type)
+    
+    # Cheap when nothing changed: the storage version is compared first
+    with st.spinner("Syncing saved metadata..."):
+        sync_summary = sync_analytics_mirror(storage)
+    if sync_summary.get(sheet_name, {}).get("error"):
+        st.warning(f"Could not read {sheet_name}; showing the last synced copy.")
+    if sheet_name not in analytics_mirror_summary():
+        st.info(f"No {sheet_name} rows have been synced yet.")
+        return
+    
+    options = analytics_filter_options(sheet_name)
+    years = options.get("academic_year", [])
+    
+    st.markdown('<p class="section-header">Filters</p>', unsafe_allow_html=True)
+    col1, col2, col3 = st.columns(3)
+    filters = {}
+    with col1:
+        filters["college_division"] = st.multiselect(
+            "College / Division", options.get("college_division", []), key="explore_college_division"
+        )
+        filters["search"] = st.text_input("Unit ID or name contains", key="explore_search")
+    with col2:
+        filters["year_from"] = st.selectbox("From year", [""] + years, key="explore_year_from")
+        filters["year_to"] = st.selectbox("To year", [""] + years, key="explore_year_to")
+    with col3:
+        if "achievement_level" in options:
+            filters["achievement_level"] = st.multiselect(
+                "Achievement Level", options["achievement_level"], key="explore_achievement_level"
+            )
+        filters["unit_id"] = st.multiselect("Unit IDs", options.get("unit_id", []), key="explore_unit_id")
+    
+    started = time.perf_counter()
+    df = query_analytics_mirror(sheet_name, filters)
+    elapsed = time.perf_counter() - started
+    
+    st.markdown('<p class="section-header">Rows</p>', unsafe_allow_html=True)
+    st.caption(f"{len(df):,} rows · queried in {elapsed * 1000:.0f} ms")
+    st.dataframe(df, hide_index=True, use_container_width=True)
+    st.download_button(
+        "Download CSV",
+        data=df.to_csv(index=False).encode("utf-8"),
+        file_name=f"{analytics_table(sheet_name)}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+        mime="text/csv",
+        disabled=df.empty
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
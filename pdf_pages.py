@@ -0,0 +1,32 @@
+"""
+Page-range PDF text extraction for worker processes.
+
+app.py runs this file as a separate program for each page range, so workers
+start fresh (never forked from the multi-threaded server) and only import
+PyPDF2, not the Streamlit app.
+
+Usage: python pdf_pages.py <pdf path> <start> <stop>
+Prints a JSON list of [text, seconds] pairs for pages [start, stop).
+"""
+
+import json
+import sys
+import time
+
+import PyPDF2
+
+
+def extract_pdf_pages(pdf_path: str, start: int, stop: int) -> list:
+    """Extract pages [start, stop) as (text, seconds) pairs."""
+    reader = PyPDF2.PdfReader(pdf_path)
+    pages = []
+    for page_number in range(start, stop):
+        page_start = time.perf_counter()
+        page_text = reader.pages[page_number].extract_text()
+        pages.append((page_text, time.perf_counter() - page_start))
+    return pages
+
+
+if __name__ == "__main__":
+    pdf_path, start, stop = sys.argv[1], int(sys.argv[2]), int(sys.argv[3])
+    json.dump(extract_pdf_pages(pdf_path, start, stop), sys.stdout)
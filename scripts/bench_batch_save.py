@@ -0,0 +1,97 @@
+"""
+Compare saving a batch of reports one at a time with save_reports_to_excel_online.
+
+Runs against scripts/mock_graph.py with simulated latency, checks that both
+paths leave the same sheet contents, and checks that a failed range update
+is reported for exactly the reports it covers.
+
+Usage: python scripts/bench_batch_save.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_graph
+
+os.environ["GRAPH_BASE_URL"] = mock_graph.start()
+
+import app  # noqa: E402
+
+HEADERS = app.RESULTS_SHEET_HEADERS
+UNITS = 250
+REPORTS = 100
+
+
+def seed_sheet():
+    rows = [list(HEADERS)]
+    for unit in range(UNITS):
+        for outcome in range(8):
+            record = dict.fromkeys(HEADERS, "")
+            record.update(unit_id=f"U{unit}", academic_year="2023-2024", outcome_id=f"O{outcome}",
+                          achievement_level="Fully Achieved")
+            rows.append([record[h] for h in HEADERS])
+    mock_graph.STATE["sheets"] = {"Results_Data": rows}
+    app.invalidate_worksheet_cache("drive", "item")
+
+
+def make_reports() -> list:
+    random.seed(5)
+    reports = []
+    for k in range(REPORTS):
+        # Mix updates of existing units (with fewer outcomes, so orphans are cleared) and new units
+        unit = random.choice([f"U{random.randrange(UNITS)}", f"N{k}"])
+        metadata = {
+            "unit_id": unit, "unit_type": "Academic", "unit_name": unit, "academic_year": "2023-2024",
+            "outcomes": [{"outcome_id": f"O{o}", "assessment_method": f"method {k}"} for o in range(random.randint(3, 8))]
+        }
+        reports.append(app.prepare_rows_for_sheet(metadata, "Results Report"))
+    return reports
+
+
+def sheet_contents() -> list:
+    kept = [i for i, h in enumerate(HEADERS) if h not in ("upload_timestamp", "last_updated")]
+    rows = mock_graph.STATE["sheets"]["Results_Data"][1:]
+    return sorted(tuple(row[i] for i in kept) for row in rows if any(row))
+
+
+def main():
+    reports = make_reports()
+    mock_graph.STATE["latency"] = 0.03
+    
+    seed_sheet()
+    start_requests, start = mock_graph.STATE["requests"], time.perf_counter()
+    for rows in reports:
+        app.save_metadata_to_excel_online("token", "drive", "item", rows, "Results Report")
+    one_by_one = (mock_graph.STATE["requests"] - start_requests, time.perf_counter() - start, sheet_contents())
+    
+    seed_sheet()
+    start_requests, start = mock_graph.STATE["requests"], time.perf_counter()
+    saved = app.save_reports_to_excel_online("token", "drive", "item", reports, "Results Report")
+    batched = (mock_graph.STATE["requests"] - start_requests, time.perf_counter() - start, sheet_contents())
+    
+    print(f"one at a time: {one_by_one[0]} requests in {one_by_one[1]:.2f}s")
+    print(f"batched:       {batched[0]} requests in {batched[1]:.2f}s")
+    print(f"same sheet contents: {one_by_one[2] == batched[2]}; all reports saved: {all(saved)}")
+    
+    # Fail the range holding the first report's rows; only reports writing there may be flagged
+    seed_sheet()
+    mock_graph.STATE["latency"] = 0.0
+    existing = app._records_from_values(mock_graph.STATE["sheets"]["Results_Data"])
+    report_rows = []
+    writes = app.plan_batch_sheet_writes(existing, reports, HEADERS, report_rows)
+    first_row, values = app.coalesce_row_writes(writes, existing, HEADERS)[0]
+    failed = set(range(first_row, first_row + len(values)))
+    mock_graph.STATE["fail_ranges"] = {f"A{first_row}:{app._column_letter(len(HEADERS))}{first_row + len(values) - 1}"}
+    saved = app.save_reports_to_excel_online("token", "drive", "item", reports, "Results Report")
+    mock_graph.STATE["fail_ranges"] = set()
+    expected = [not (rows & failed) for rows in report_rows]
+    print(f"failed range flags {saved.count(False)} of {len(saved)} reports; matches plan: {saved == expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compare history lookups through the Results_Data index with a scan of every row.
+
+Serves a synthetic 100k-row Results_Data sheet from scripts/mock_graph.py,
+with some academic years stored as numbers and some as text, and checks that
+get_historical_data returns the same records as a plain filter-and-sort.
+
+Usage: python scripts/bench_history_index.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_graph
+
+os.environ["GRAPH_BASE_URL"] = mock_graph.start()
+os.environ["ANALYZER_CACHE_DIR"] = tempfile.mkdtemp()
+
+import app  # noqa: E402
+
+HEADERS = app.RESULTS_SHEET_HEADERS
+UNITS = 800
+OUTCOMES = 12
+ROWS = 100_000
+QUERIES = 500
+
+
+def seed_sheet():
+    random.seed(13)
+    rows = [list(HEADERS)]
+    for _ in range(ROWS):
+        record = dict.fromkeys(HEADERS, "")
+        year = random.randrange(2015, 2025)
+        # Hand-entered years come back from Excel as numbers
+        record.update(unit_id=f"U{random.randrange(UNITS)}", outcome_id=f"O{random.randrange(OUTCOMES)}",
+                      academic_year=year if random.random() < 0.2 else f"{year}-{year + 1}")
+        rows.append([record[h] for h in HEADERS])
+    mock_graph.STATE["sheets"] = {"Results_Data": rows}
+
+
+def scan(records: list, unit_id: str, outcome_id: str) -> list:
+    matches = [r for r in records if r.get("unit_id") == unit_id and r.get("outcome_id") == outcome_id]
+    return sorted(matches, key=lambda r: str(r.get("academic_year", "")))
+
+
+def main():
+    seed_sheet()
+    storage = app.excel_storage("token", "drive", "item")
+    records = app.get_storage_records(storage, "Results_Data")
+
+    start = time.perf_counter()
+    app.get_historical_data(storage, "U0", "O0")
+    build = time.perf_counter() - start
+
+    queries = [(f"U{random.randrange(UNITS)}", f"O{random.randrange(OUTCOMES)}") for _ in range(QUERIES)]
+
+    start = time.perf_counter()
+    expected = [scan(records, unit_id, outcome_id) for unit_id, outcome_id in queries]
+    scanned = (time.perf_counter() - start) / QUERIES
+
+    start = time.perf_counter()
+    indexed = [app.get_historical_data(storage, unit_id, outcome_id) for unit_id, outcome_id in queries]
+    looked_up = (time.perf_counter() - start) / QUERIES
+
+    print(f"{len(records)} rows, {UNITS} units, {OUTCOMES} outcomes")
+    print(f"index build (first lookup): {build * 1000:.0f} ms")
+    print(f"per lookup: scan {scanned * 1000:.2f} ms, index {looked_up * 1e6:.1f} us")
+    print(f"same records for all {QUERIES} queries: {indexed == expected}; "
+          f"empty results: {sum(1 for result in indexed if not result)}")
+
+
+if __name__ == "__main__":
+    main()
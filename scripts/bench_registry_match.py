@@ -0,0 +1,113 @@
+"""
+Compare find_matching_unit with a registry-order scan of every unit.
+
+The scan is the matcher as it was before the registry index, with blank
+names skipped. Both run over the same synthetic registries and queries
+(exact, previous-name, partial, reordered, unknown and blank names, plus
+units with missing or non-text names) and must return the same unit.
+
+Usage: python scripts/bench_registry_match.py
+"""
+
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+WORDS = ["applied", "biology", "business", "center", "chemistry", "data", "design", "education",
+         "engineering", "health", "history", "music", "nursing", "office", "research", "science",
+         "services", "student", "studies", "systems", "technology", "writing"]
+QUERIES = 2000
+
+
+def scan(extracted_name: str, registry_list: list) -> dict:
+    extracted_lower = extracted_name.lower().strip()
+    if not extracted_lower:
+        return None
+
+    def canonical_of(unit):
+        canonical = unit.get("canonical_name", "")
+        return canonical.lower().strip() if isinstance(canonical, str) else ""
+
+    for unit in registry_list:
+        if canonical_of(unit) and canonical_of(unit) == extracted_lower:
+            return unit
+    for unit in registry_list:
+        previous = unit.get("previous_names", "")
+        if previous and isinstance(previous, str):
+            if extracted_lower in [p.strip().lower() for p in previous.split(";") if p.strip()]:
+                return unit
+    for unit in registry_list:
+        canonical = canonical_of(unit)
+        if canonical and (extracted_lower in canonical or canonical in extracted_lower):
+            return unit
+
+    extracted_terms = set(re.findall(r'\b\w+\b', extracted_lower))
+    best_match, best_score = None, 0
+    for unit in registry_list:
+        common = extracted_terms & set(re.findall(r'\b\w+\b', canonical_of(unit)))
+        if len(common) > best_score and len(common) >= 2:
+            best_match, best_score = unit, len(common)
+    return best_match if best_score >= 3 else None
+
+
+def make_registry(size: int) -> list:
+    units = []
+    for i in range(size):
+        name = " ".join(random.sample(WORDS, random.randint(2, 4))).title()
+        unit = {"unit_id": f"A{i}", "canonical_name": name, "previous_names": ""}
+        if random.random() < 0.2:
+            unit["previous_names"] = f"Old {name}; ;Department of {name}"
+        if random.random() < 0.02:
+            unit["canonical_name"] = random.choice([None, 0, "", "  "])
+        units.append(unit)
+    return units
+
+
+def make_queries(registry_list: list) -> list:
+    queries = []
+    for _ in range(QUERIES):
+        unit = random.choice(registry_list)
+        name = unit["canonical_name"] if isinstance(unit["canonical_name"], str) else ""
+        queries.append(random.choice([
+            name,
+            f"Old {name}",
+            name.split(" ")[0],
+            " ".join(reversed(name.split(" "))),
+            " ".join(random.sample(WORDS, 3)),
+            "",
+        ]))
+    return queries
+
+
+def main():
+    random.seed(15)
+    for size in (50, 500):
+        registry_list = make_registry(size)
+        registry = {"academic": registry_list, "administrative": []}
+        queries = make_queries(registry_list)
+
+        start = time.perf_counter()
+        expected = [scan(query, registry_list) for query in queries]
+        scanned = (time.perf_counter() - start) / QUERIES
+
+        start = time.perf_counter()
+        app.get_registry_index(registry, "Academic")
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        matched = [app.find_matching_unit(query, "Academic", registry)["match"] for query in queries]
+        indexed = (time.perf_counter() - start) / QUERIES
+
+        same = all(a is b for a, b in zip(matched, expected))
+        print(f"{size} units: scan {scanned * 1e6:.0f} us, index {indexed * 1e6:.1f} us per call "
+              f"(build {build * 1000:.1f} ms); same unit for all {QUERIES} queries: {same}")
+
+
+if __name__ == "__main__":
+    main()
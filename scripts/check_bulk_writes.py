@@ -0,0 +1,56 @@
+"""
+Check that coalesced bulk writes leave untouched rows alone.
+
+Saves reports through save_metadata_to_excel_online against
+scripts/mock_graph.py, after another user has edited an unrelated row
+following the app's read, and compares the result with row-by-row writes.
+Run with BULK_WRITE_MAX_GAP=25 to see the edit being overwritten when
+bridging is turned on.
+
+Usage: python scripts/check_bulk_writes.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mock_graph
+
+os.environ["GRAPH_BASE_URL"] = mock_graph.start()
+
+import app  # noqa: E402
+
+HEADERS = app.RESULTS_SHEET_HEADERS
+
+
+def main():
+    rows = [list(HEADERS)]
+    for unit in range(10):
+        record = dict.fromkeys(HEADERS, "")
+        record.update(unit_id=f"U{unit}", academic_year="2023-2024", outcome_id="O1", benchmark="70%")
+        rows.append([record[h] for h in HEADERS])
+    mock_graph.STATE["sheets"] = {"Results_Data": rows}
+    
+    existing = app._records_from_values(mock_graph.STATE["sheets"]["Results_Data"])
+    metadata_rows = []
+    for unit in (2, 6):
+        metadata = {"unit_id": f"U{unit}", "academic_year": "2023-2024",
+                    "outcomes": [{"outcome_id": "O1", "benchmark": "80%"}]}
+        metadata_rows.extend(app.prepare_rows_for_sheet(metadata, "Results Report"))
+    writes = app.plan_sheet_writes(existing, metadata_rows, HEADERS)
+    ranges = app.coalesce_row_writes(writes, existing, HEADERS)
+    print(f"BULK_WRITE_MAX_GAP={app.BULK_WRITE_MAX_GAP}: {len(writes)} rows in {len(ranges)} ranges")
+    
+    # Someone else edits U4 (sheet row 6) between the app's read and its write
+    benchmark_column = HEADERS.index("benchmark")
+    mock_graph.STATE["sheets"]["Results_Data"][5][benchmark_column] = "90%"
+    app._write_planned_rows("token", "drive", "item", "Results_Data", HEADERS, writes, existing, {})
+    
+    kept = mock_graph.STATE["sheets"]["Results_Data"][5][benchmark_column] == "90%"
+    print(f"concurrent edit to an untouched row kept: {kept}")
+
+
+if __name__ == "__main__":
+    main()
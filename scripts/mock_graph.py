@@ -0,0 +1,135 @@
+"""
+In-process mock of the Microsoft Graph workbook endpoints used by app.py.
+
+Serves worksheets from STATE["sheets"] ({name: [[row values], ...]}), counts
+requests, and can simulate latency, throttling and failing range updates.
+Point the app at it by setting GRAPH_BASE_URL to the URL start() returns
+before importing app.
+"""
+
+import json
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATE = {
+    "sheets": {},
+    "requests": 0,
+    "latency": 0.0,      # seconds added to every HTTP request
+    "version": 1,        # bumped on every write; reported as the item's cTag
+    "throttle": 0,       # number of upcoming requests to answer with 429
+    "fail_ranges": set() # range addresses whose PATCH returns 500
+}
+
+
+def _column_index(letters: str) -> int:
+    number = 0
+    for ch in letters:
+        number = number * 26 + (ord(ch) - 64)
+    return number
+
+
+def _set_range(sheet: str, address: str, values: list):
+    match = re.match(r"([A-Z]+)(\d+):([A-Z]+)(\d+)", address)
+    first_col, first_row = _column_index(match[1]), int(match[2])
+    last_col, last_row = _column_index(match[3]), int(match[4])
+    assert last_row - first_row + 1 == len(values), (address, len(values))
+    rows = STATE["sheets"][sheet]
+    while len(rows) < last_row:
+        rows.append([])
+    for i, row_values in enumerate(values):
+        row = rows[first_row - 1 + i]
+        while len(row) < last_col:
+            row.append("")
+        for j, value in enumerate(row_values):
+            row[first_col - 1 + j] = value
+    STATE["version"] += 1
+
+
+def _used_range(sheet: str) -> list:
+    rows = STATE["sheets"][sheet]
+    while rows and not any(rows[-1]):
+        rows.pop()
+    width = max((len(row) for row in rows), default=0)
+    return [row + [""] * (width - len(row)) for row in rows]
+
+
+def _handle(method: str, path: str, body):
+    path = urllib.parse.unquote(path.split("?")[0])
+    match = re.match(
+        r".*/drives/[^/]+/items/[^/]+(/workbook/worksheets(?:/([^/]+))?(/usedRange|/range\(address='([^']+)'\))?)?$",
+        path
+    )
+    if not match:
+        return 404, {"error": {"code": "notFound", "message": path}}
+    if match[1] is None:
+        return 200, {"id": "item", "eTag": f"e{STATE['version']}", "cTag": f"c{STATE['version']}"}
+    
+    sheet = match[2]
+    if sheet is None:
+        if method == "GET":
+            return 200, {"value": [{"name": name} for name in STATE["sheets"]]}
+        if body["name"] in STATE["sheets"]:
+            return 409, {"error": {"code": "ItemAlreadyExists"}}
+        STATE["sheets"][body["name"]] = []
+        return 201, {"name": body["name"]}
+    
+    if sheet not in STATE["sheets"]:
+        return 404, {"error": {"code": "ItemNotFound", "message": sheet}}
+    if match[3] == "/usedRange":
+        return 200, {"values": _used_range(sheet) or [[""]]}
+    if match[4] and method == "PATCH":
+        if match[4] in STATE["fail_ranges"]:
+            return 500, {"error": {"code": "InternalServerError", "message": "simulated failure"}}
+        _set_range(sheet, match[4], body["values"])
+        return 200, {"address": match[4]}
+    return 400, {"error": {"code": "BadRequest"}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+    
+    def _dispatch(self, method: str):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        STATE["requests"] += 1
+        time.sleep(STATE["latency"])
+        if STATE["throttle"] > 0:
+            STATE["throttle"] -= 1
+            return self._send(429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": "0"})
+        if self.path.endswith("/$batch") and method == "POST":
+            responses = []
+            for request in body["requests"]:
+                status, response_body = _handle(request["method"], "/" + request["url"].lstrip("/"), request.get("body"))
+                responses.append({"id": request["id"], "status": status, "body": response_body, "headers": {}})
+            return self._send(200, {"responses": responses})
+        self._send(*_handle(method, self.path, body))
+    
+    def _send(self, status: int, body, headers: dict = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def do_GET(self):
+        self._dispatch("GET")
+    
+    def do_POST(self):
+        self._dispatch("POST")
+    
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+
+def start() -> str:
+    """Serve the mock on a free local port; returns the Graph base URL."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1.0"